@@ -0,0 +1,172 @@
+# 命令行下载：不需要图形界面，适合在服务器上由 systemd/supervisor 等托管批量运行
+# python 177cli.py -o /data/177pica URL [URL ...] [-f urls.txt] [--workers 16] [--jsonl]
+# 条目页地址直接下载，其他地址按分类首页抓取；--jsonl 时 stdout 每行输出一个 JSON 进度事件，文字日志输出到 stderr
+# 分布式：python 177cli.py -o DIR --enqueue URL 把条目写入 DIR 下的工作队列，各机器上 python 177cli.py -o DIR --worker 领取下载
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import transport
+import bandwidth
+import core
+import metrics
+
+
+def read_url_file(path):
+    # 每行一个地址，# 开头的行和空行忽略；- 表示从标准输入读取
+    f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+_lock = threading.Lock()
+
+
+def make_log(args):
+    # --jsonl 时文字日志输出到 stderr，stdout 只留给 JSON 进度事件
+    log_stream = sys.stderr if args.jsonl else sys.stdout
+
+    def log(msg):
+        if not args.quiet:
+            with _lock:
+                print(msg, file=log_stream, flush=True)
+    return log
+
+
+def make_progress(args):
+    if not args.jsonl:
+        return None
+
+    # --processes 时多个工作进程共用同一个 stdout 管道：每个事件一次 os.write 写出整行，
+    # 短于 PIPE_BUF 的写入是原子的，各进程的行不会交错
+    def progress(event):
+        data = (json.dumps(event, ensure_ascii=False) + '\n').encode()
+        with _lock:
+            while data:
+                data = data[os.write(1, data):]
+    return progress
+
+
+def start_exporter(args, index=None):
+    # --processes 时每个工作进程用各自的文件名和端口：metrics-1.prom、端口 +1 ...
+    textfile, port = args.metrics_file, args.metrics_port
+    if index is not None:
+        if textfile:
+            root, ext = os.path.splitext(textfile)
+            textfile = f'{root}-{index}{ext}'
+        if port is not None:
+            port += index
+    return metrics.Exporter(textfile, port)
+
+
+def start_bandwidth(args):
+    # --processes 时各工作进程平分总速率；--limit-file 的内容变化后随时生效
+    parts = args.processes if args.worker else 1
+    if args.limit_rate:
+        transport.bandwidth_limit.set_rate(args.limit_rate // parts)
+    if args.limit_file:
+        return bandwidth.RateFile(args.limit_file, transport.bandwidth_limit, make_log(args), parts=parts)
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='177pica 命令行下载')
+    parser.add_argument('urls', nargs='*', help='条目页或分类首页地址')
+    parser.add_argument('-f', '--file', action='append', default=[], help='地址列表文件，可重复指定，- 表示标准输入')
+    parser.add_argument('-o', '--output', required=True, help='保存目录')
+    parser.add_argument('-w', '--workers', type=int, default=core.IMG_WORKERS, help='图片下载线程数')
+    parser.add_argument('--per-host', type=int, default=core.IMG_PER_HOST, help='单个图床主机的最大并发')
+    parser.add_argument('--max-per-host', type=int, help='自适应限流对单个主机允许的最大并发')
+    parser.add_argument('--backend', choices=core.BACKENDS, default='threads', help='下载引擎')
+    parser.add_argument('--no-cache', action='store_true', help='不使用页面缓存')
+    parser.add_argument('--incremental', action='store_true', help='分类增量更新，遇到整页已处理过的条目就停止')
+    parser.add_argument('--dedupe', action='store_true', help='图片存入内容寻址仓库，重复图片只保存一份')
+    parser.add_argument('--cbz', action='store_true', help='条目下载完成后打包成 CBZ(不压缩)')
+    parser.add_argument('--remove-loose', action='store_true', help='打包 CBZ 后删除散图')
+    parser.add_argument('--write-behind', action='store_true',
+                        help='图片由后台写盘线程写入，保存目录在 NAS/移动硬盘上时网络不被慢写盘拖住')
+    parser.add_argument('--fsync', choices=core.FSYNC_POLICIES, default=core.FSYNC_NONE,
+                        help='--write-behind 时的落盘策略：none 交给系统，file 每个文件写完都 fsync')
+    parser.add_argument('--limit-rate', type=bandwidth.parse_rate, default=0,
+                        help='图片下载的总带宽上限，如 500K、2M；--processes 时各进程平分')
+    parser.add_argument('--limit-file', help='运行中从该文件读取带宽上限(内容如 2M，0 为不限速)，修改后几秒内生效')
+    parser.add_argument('--retry-wait', type=float, default=core.RETRY_WAIT, help='结束前最多等待自动重试的秒数')
+    parser.add_argument('--enqueue', action='store_true', help='协调者：只抓分类列表，把条目写入保存目录下的工作队列')
+    parser.add_argument('--worker', action='store_true', help='工作进程：从保存目录下的工作队列领取条目下载')
+    parser.add_argument('--processes', type=int, default=1, help='--worker 时在本机启动的工作进程数')
+    parser.add_argument('--wait', action='store_true', help='--worker 时队列空了也不退出，等待新条目')
+    parser.add_argument('--metrics-file', help='定期把 Prometheus 格式的指标写入该文件(node_exporter textfile)')
+    parser.add_argument('--metrics-port', type=int, help='在 127.0.0.1 的该端口提供 Prometheus 指标')
+    parser.add_argument('--jsonl', action='store_true', help='stdout 输出 JSON lines 进度事件')
+    parser.add_argument('-q', '--quiet', action='store_true', help='不输出文字日志')
+    args = parser.parse_args(argv)
+
+    urls = list(args.urls)
+    for path in args.file:
+        urls.extend(read_url_file(path))
+    if not urls and not args.worker:
+        parser.error('至少需要一个地址(命令行参数或 -f 文件)')
+    if args.max_per_host:
+        transport.configure(max_per_host=args.max_per_host)
+
+    # 被托管进程管理器停止时正常退出，让清单、缓存和队列租约完成收尾
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    if args.worker and args.processes > 1:
+        import multiprocessing
+        procs = [multiprocessing.Process(target=work, args=(args, i)) for i in range(1, args.processes + 1)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        return 1 if any(proc.exitcode for proc in procs) else 0
+    if args.worker:
+        return work(args)
+    exporter = start_exporter(args)
+    rate_file = start_bandwidth(args)
+    try:
+        if args.enqueue:
+            added = core.enqueue(urls, args.output, make_log(args), use_cache=not args.no_cache,
+                                 incremental=args.incremental)
+            make_log(args)(f"新加入队列{added}个条目")
+            return 0
+        remaining = core.run(urls, args.output, make_log(args), make_progress(args), workers=args.workers,
+                             per_host=args.per_host, backend=args.backend, use_cache=not args.no_cache,
+                             incremental=args.incremental, use_store=args.dedupe, retry_wait=args.retry_wait,
+                             package=args.cbz, remove_loose=args.remove_loose, write_behind=args.write_behind,
+                             fsync=args.fsync)
+    finally:
+        if rate_file:
+            rate_file.close()
+        exporter.close()
+    return 1 if remaining else 0
+
+
+def work(args, index=None):
+    # 工作进程入口，--processes 时在子进程中执行，index 从 1 开始
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    if args.max_per_host:
+        transport.configure(max_per_host=args.max_per_host)
+    exporter = start_exporter(args, index)
+    rate_file = start_bandwidth(args)
+    try:
+        remaining = core.work(args.output, make_log(args), make_progress(args), workers=args.workers,
+                              per_host=args.per_host, use_cache=not args.no_cache, use_store=args.dedupe,
+                              retry_wait=args.retry_wait, package=args.cbz, remove_loose=args.remove_loose,
+                              wait=args.wait, write_behind=args.write_behind, fsync=args.fsync)
+    finally:
+        if rate_file:
+            rate_file.close()
+        exporter.close()
+    return 1 if remaining else 0
+
+
+if __name__ == '__main__':
+    # 打包成 exe 后 --cbz 的打包进程池和 --processes 的子进程需要它，否则子进程会重新执行整个程序
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
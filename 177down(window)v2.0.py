@@ -1,173 +1,26 @@
-import os
-import requests
-from bs4 import BeautifulSoup
-from lxml import etree
-import re
+import threading
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox, filedialog, scrolledtext
+from core import IMG_WORKERS, IMG_PER_HOST
+from guilog import LogPane
+from jobs import JobScheduler, MAX_JOBS
+from transport import bandwidth_limit
+from bandwidth import parse_rate, format_rate
+
+# 任务列表的刷新间隔(毫秒)
+REFRESH_MS = 500
+STATE_NAMES = {'queued': '排队', 'running': '下载中', 'paused': '已暂停', 'done': '完成',
+               'partial': '部分失败', 'failed': '失败', 'cancelled': '已取消'}
+
+# 当前批次的任务调度器，全部任务结束后置为 None
+scheduler = None
 
 def log(message, widget=None):
+    # widget 为 guilog.LogPane，可在下载线程中调用，由界面线程定时批量写入文本框
     print(message)
     if widget:
-        widget.configure(state='normal')
-        widget.insert(tk.END, message + "\n")
-        widget.see(tk.END)
-        widget.update()
-        widget.configure(state='disabled')
-
-def comic_downloader(url, save_to, log_widget=None, failed_imgs=None):
-    headers = {'user-agent': 'Mozilla/5.0'}
-    try:
-        resp = requests.get(url, headers=headers, timeout=15)
-        resp.raise_for_status()
-    except Exception as e:
-        log(f"首页请求失败：{e}", log_widget)
-        if failed_imgs is not None:
-            failed_imgs.append({
-                "comic_title": url,
-                "page": "首页",
-                "img_url": url,
-                "img_path": "",
-                "err": str(e)
-            })
-        return
-
-    soup = BeautifulSoup(resp.text, 'html.parser')
-    title_tag = soup.find('h1', class_='entry-title')
-    if title_tag and title_tag.get_text(strip=True):
-        comic_title = title_tag.get_text(strip=True)
-    else:
-        comic_title = soup.title.string.strip() if soup.title else 'Comic'
-    for ch in '\\/:*?"<>|':
-        comic_title = comic_title.replace(ch, '_')
-
-    save_dir = os.path.join(save_to, comic_title, 'images')
-    os.makedirs(save_dir, exist_ok=True)
-
-    # 自动获取end_page
-    pagination = soup.find('div', class_='page-links')
-    end_page = 1
-    if pagination:
-        page_links = pagination.find_all('a')
-        page_numbers = [int(a.get_text()) for a in page_links if a.get_text().isdigit()]
-        if page_numbers:
-            end_page = max(page_numbers)
-    else:
-        numbers = re.findall(r'/(\d+)[/">]', resp.text)
-        if numbers:
-            end_page = max([int(n) for n in numbers])
-
-    log(f"开始爬取：《{comic_title}》，共 {end_page} 页，保存到 {save_dir}", log_widget)
-
-    img_count = 1
-    for page in range(1, end_page + 1):
-        if page == 1:
-            pageurl = url
-        else:
-            pageurl = f'{url}/{page}'
-        log(f'抓取第{page}页: {pageurl}', log_widget)
-        try:
-            resp = requests.get(pageurl, headers=headers, timeout=15)
-            resp.raise_for_status()
-        except Exception as e:
-            log(f"第{page}页请求失败：{e}", log_widget)
-            if failed_imgs is not None:
-                failed_imgs.append({
-                    "comic_title": comic_title,
-                    "page": page,
-                    "img_url": pageurl,
-                    "img_path": "",
-                    "err": str(e)
-                })
-            continue
-
-        html = resp.text
-        ele = etree.HTML(html)
-        img_urls = ele.xpath("//div[@class='single-content']//img/@data-lazy-src")
-        if not img_urls:
-            img_urls = ele.xpath("//div[@class='single-content']//img/@src")
-        if not img_urls:
-            log(f"第{page}页未找到图片。", log_widget)
-            if failed_imgs is not None:
-                failed_imgs.append({
-                    "comic_title": comic_title,
-                    "page": page,
-                    "img_url": pageurl,
-                    "img_path": "",
-                    "err": "未找到图片"
-                })
-            continue
-
-        for img_url in img_urls:
-            original_img_url = img_url
-            # 拼接完整URL
-            if img_url.startswith('//'):
-                img_url = 'http:' + img_url
-            elif img_url.startswith('/'):
-                img_url = 'http://www.177pica.com' + img_url
-            elif not img_url.startswith('http'):
-                img_url = 'http://' + img_url
-
-            img_name = f"{img_count:03d}.jpg"
-            img_path = os.path.join(save_dir, img_name)
-            if os.path.exists(img_path):
-                log(f"{img_name} 已存在，跳过。", log_widget)
-                img_count += 1
-                continue
-
-            try:
-                log(f"下载 {img_name} : {img_url}", log_widget)
-                img_resp = requests.get(img_url, headers=headers, timeout=15)
-                img_resp.raise_for_status()
-                with open(img_path, 'wb') as f:
-                    f.write(img_resp.content)
-                img_count += 1
-            except Exception as e:
-                log(f"图片下载失败: {img_url}，原因：{e}", log_widget)
-                if failed_imgs is not None:
-                    failed_imgs.append({
-                        "comic_title": comic_title,
-                        "page": page,
-                        "img_url": original_img_url,
-                        "img_path": img_path,
-                        "err": str(e)
-                    })
-
-def retry_failed_imgs(failed_imgs, log_widget=None):
-    if not failed_imgs:
-        return []
-    log("==== 开始尝试重下失败图片 ====", log_widget)
-    still_failed = []
-    headers = {'user-agent': 'Mozilla/5.0'}
-    for item in failed_imgs:
-        img_url = item["img_url"]
-        img_path = item["img_path"]
-        # 拼接完整URL
-        if img_url.startswith('//'):
-            img_url_full = 'http:' + img_url
-        elif img_url.startswith('/'):
-            img_url_full = 'http://www.177pica.com' + img_url
-        elif not img_url.startswith('http'):
-            img_url_full = 'http://' + img_url
-        else:
-            img_url_full = img_url
-        # 页面请求失败和找不到图片没有img_path，跳过
-        if not img_path:
-            still_failed.append(item)
-            continue
-        try:
-            log(f"重试下载：{img_url_full}", log_widget)
-            resp = requests.get(img_url_full, headers=headers, timeout=15)
-            resp.raise_for_status()
-            with open(img_path, 'wb') as f:
-                f.write(resp.content)
-        except Exception as e:
-            log(f"重试失败：{img_url_full}，原因：{e}", log_widget)
-            item["err"] = str(e)
-            still_failed.append(item)
-    log(f"重试完成，剩余失败数量：{len(still_failed)}", log_widget)
-    return still_failed
+        widget.write(message)
 
 def choose_dir(entry):
     path = filedialog.askdirectory(title='选择保存目录')
@@ -184,39 +37,92 @@ def import_urls_from_file(url_box):
         url_box.delete('1.0', tk.END)
         url_box.insert(tk.END, urls)
 
-def start_download(url_box, path_entry, log_box):
+def start_download(url_box, path_entry, store_var, jobs_spin, priority_spin, log_box):
+    # 地址加入任务调度器后台下载，多个漫画同时进行，共用同一个下载线程池；界面线程不再被阻塞
+    # 上一批还没结束时新地址直接加入当前批次
+    global scheduler
     urls = url_box.get('1.0', tk.END).strip().splitlines()
     urls = [u.strip() for u in urls if u.strip()]
     save_to = path_entry.get().strip()
     if not urls or not save_to:
         messagebox.showerror("错误", "请填写完整URL和保存目录！")
         return
-    log_box.configure(state='normal')
-    log_box.delete(1.0, tk.END)
-    log_box.configure(state='disabled')
-    def run_all():
-        all_failed_imgs = []
-        for i, url in enumerate(urls, 1):
-            log(f"\n===== 开始下载第{i}个漫画: {url} =====", log_box)
-            comic_downloader(url, save_to, log_box, all_failed_imgs)
-        # 一次失败后重试
-        if all_failed_imgs:
-            log(f"\n以下图片初次下载失败，开始尝试重试...\n", log_box)
-            still_failed = retry_failed_imgs(all_failed_imgs, log_box)
-        else:
-            still_failed = []
-        # 剩余失败写入txt
-        if still_failed:
-            txt_path = os.path.join(save_to, "download_failed.txt")
-            with open(txt_path, 'w', encoding='utf-8') as f:
-                for item in still_failed:
-                    f.write(f"{item['comic_title']}\t第{item['page']}页\t{item['img_url']}\t{item['img_path']}\t{item.get('err','')}\n")
-            log(f"有{len(still_failed)}个图片下载失败，详情见 {txt_path}", log_box)
-            messagebox.showwarning("下载完成", f"有{len(still_failed)}个图片下载失败，详情见 {txt_path}")
+    try:
+        max_jobs = max(1, int(jobs_spin.get()))
+        priority = int(priority_spin.get())
+    except ValueError:
+        messagebox.showerror("错误", "同时下载数和优先级必须是整数！")
+        return
+    if scheduler is not None and scheduler.save_dir != save_to:
+        messagebox.showerror("错误", f"当前还有任务在下载到 {scheduler.save_dir}，请等待完成后再换保存目录")
+        return
+    if scheduler is None:
+        log_box.clear()
+        # 下载、重试和失败列表的读写都在 core.Downloader 中，与其他窗口和命令行共用
+        scheduler = JobScheduler(save_to, lambda msg: log(msg, log_box), max_jobs, IMG_WORKERS, IMG_PER_HOST,
+                                 store_var.get())
+    scheduler.max_jobs = max_jobs
+    for url in urls:
+        scheduler.add(url, priority)
+
+def finish_batch(done_scheduler, log_box):
+    # 在后台线程中等待重试并写失败列表
+    still_failed = done_scheduler.finish()
+    if still_failed:
+        log_box.call(messagebox.showwarning, "下载完成", f"有{still_failed}项下载未成功，下次运行会继续重试")
+    else:
+        log("全部任务完成，无下载失败图片！", log_box)
+        log_box.call(messagebox.showinfo, "完成", "全部任务完成，无下载失败图片！")
+
+def refresh_jobs(job_tree, log_box):
+    # 界面线程定时读取任务状态刷新列表；全部任务结束后收尾
+    global scheduler
+    if scheduler is not None:
+        for job in list(scheduler.jobs):
+            values = (job.id, job.priority, job.weight, STATE_NAMES[job.state], job.describe(), job.current,
+                      job.url)
+            iid = str(job.id)
+            if job_tree.exists(iid):
+                job_tree.item(iid, values=values)
+            else:
+                job_tree.insert('', tk.END, iid=iid, values=values)
+        if scheduler.idle():
+            done_scheduler, scheduler = scheduler, None
+            if any(job.state != 'cancelled' for job in done_scheduler.jobs):
+                log("\n等待失败项自动重试...\n", log_box)
+            threading.Thread(target=finish_batch, args=(done_scheduler, log_box), daemon=True).start()
+    job_tree.after(REFRESH_MS, refresh_jobs, job_tree, log_box)
+
+def selected_jobs(job_tree):
+    if scheduler is None:
+        return []
+    ids = {int(iid) for iid in job_tree.selection()}
+    return [job for job in scheduler.jobs if job.id in ids]
+
+def control_jobs(job_tree, action):
+    # action: pause / resume / cancel / up / down / more / less，作用于列表中选中的任务
+    for job in selected_jobs(job_tree):
+        if action == 'up':
+            scheduler.set_priority(job, job.priority + 1)
+        elif action == 'down':
+            scheduler.set_priority(job, job.priority - 1)
+        elif action == 'more':
+            scheduler.set_weight(job, job.weight + 1)
+        elif action == 'less':
+            scheduler.set_weight(job, max(1, job.weight - 1))
         else:
-            log("全部任务完成，无下载失败图片！", log_box)
-            messagebox.showinfo("完成", "全部任务完成，无下载失败图片！")
-    root.after(100, run_all)
+            getattr(scheduler, action)(job)
+
+def apply_rate(rate_entry, log_box):
+    # 限速运行中随时可改，正在下载的图片下一块就按新速率；多个任务按带宽权重分配
+    try:
+        rate = parse_rate(rate_entry.get())
+    except ValueError:
+        messagebox.showerror("错误", "限速格式如 500K、2M，0 为不限速")
+        return
+    if rate != bandwidth_limit.rate:
+        bandwidth_limit.set_rate(rate)
+        log(f"限速调整为 {format_rate(rate)}", log_box)
 
 # ------ GUI 部分 ------
 root = tk.Tk()
@@ -238,13 +144,48 @@ path_entry.grid(row=1, column=1, sticky='w', pady=4)
 browse_btn = ttk.Button(frame, text="浏览", command=lambda: choose_dir(path_entry))
 browse_btn.grid(row=1, column=2, sticky='w', padx=4)
 
-download_btn = ttk.Button(frame, text="开始下载", command=lambda: start_download(url_box, path_entry, log_box))
-download_btn.grid(row=2, column=1, pady=8)
-
-log_box = scrolledtext.ScrolledText(frame, height=16, width=75, state='disabled')
-log_box.grid(row=3, column=0, columnspan=3, pady=8)
+options = ttk.Frame(frame)
+options.grid(row=2, column=1, sticky='w')
+ttk.Label(options, text="同时下载:").pack(side=tk.LEFT)
+jobs_spin = ttk.Spinbox(options, from_=1, to=16, width=4)
+jobs_spin.set(MAX_JOBS)
+jobs_spin.pack(side=tk.LEFT, padx=(0, 8))
+ttk.Label(options, text="优先级:").pack(side=tk.LEFT)
+priority_spin = ttk.Spinbox(options, from_=-9, to=9, width=4)
+priority_spin.set(0)
+priority_spin.pack(side=tk.LEFT, padx=(0, 8))
+store_var = tk.BooleanVar(value=False)
+ttk.Checkbutton(options, text="去重存储", variable=store_var).pack(side=tk.LEFT)
+download_btn = ttk.Button(frame, text="开始下载",
+                          command=lambda: start_download(url_box, path_entry, store_var, jobs_spin, priority_spin,
+                                                         log_box))
+download_btn.grid(row=2, column=2, sticky='w', padx=4, pady=8)
+
+columns = (('id', '#', 40), ('priority', '优先级', 50), ('weight', '带宽权重', 60), ('state', '状态', 70),
+           ('progress', '进度', 170), ('current', '当前条目', 140), ('url', '地址', 180))
+job_tree = ttk.Treeview(frame, columns=[c[0] for c in columns], show='headings', height=6)
+for name, text, width in columns:
+    job_tree.heading(name, text=text)
+    job_tree.column(name, width=width, stretch=name in ('current', 'url'))
+job_tree.grid(row=3, column=0, columnspan=3, sticky='we')
+
+controls = ttk.Frame(frame)
+controls.grid(row=4, column=0, columnspan=3, sticky='w', pady=4)
+for text, action in (("暂停", 'pause'), ("继续", 'resume'), ("取消", 'cancel'), ("优先级+", 'up'),
+                     ("优先级-", 'down'), ("带宽+", 'more'), ("带宽-", 'less')):
+    ttk.Button(controls, text=text, command=lambda a=action: control_jobs(job_tree, a)).pack(side=tk.LEFT, padx=2)
+ttk.Label(controls, text="限速:").pack(side=tk.LEFT, padx=(8, 0))
+rate_entry = ttk.Entry(controls, width=7)
+rate_entry.insert(0, '0')
+rate_entry.pack(side=tk.LEFT)
+ttk.Button(controls, text="应用", command=lambda: apply_rate(rate_entry, log_box)).pack(side=tk.LEFT, padx=2)
+
+log_text = scrolledtext.ScrolledText(frame, height=12, width=75, state='disabled')
+log_text.grid(row=5, column=0, columnspan=3, pady=8)
+log_box = LogPane(log_text)
+refresh_jobs(job_tree, log_box)
 
 # 窗口尺寸自适应
 frame.columnconfigure(1, weight=1)
-root.geometry("700x400")
+root.geometry("820x620")
 root.mainloop()
@@ -0,0 +1,395 @@
+# asyncio 下载引擎：单个事件循环里用协程抓取列表页、条目页和图片，
+# 用信号量限制并发，作为线程池 + requests 同步路径之外的可选后端
+import asyncio
+import collections
+import os
+import time
+from urllib.parse import urljoin
+import transport
+import metrics
+import pagecount
+from manifest import Manifest, DONE, PARTIAL, FAILED
+from store import ContentStore
+from core import LISTING_RETRIES, LISTING_RETRY_DELAY
+from extract import (extract_page, get_entries_from_page, parse_entry_page, get_image_urls_from_page,
+                     complete_img_url, image_save_path, is_entry_url)
+
+try:
+    import aiohttp
+except ImportError:  # 可选依赖，只有选择 asyncio 引擎时才需要
+    aiohttp = None
+
+# 页面(列表页+条目分页)并发 / 图片并发 / 同时处理的条目数 / 单个主机连接数
+PAGE_CONCURRENCY = 16
+IMG_CONCURRENCY = 64
+ENTRY_CONCURRENCY = 8
+PER_HOST = 32
+# 条目分页/分类列表页预取的页数，按页码顺序处理，内存里最多这么多页 HTML
+PAGE_PREFETCH = 8
+# 单个条目已创建未完成的图片任务数上限
+PENDING_IMAGES = 128
+
+
+class _Jobs:
+    # 有界的图片任务集合：已创建未完成的任务达到 limit 时先等一个完成，条目再大也不会一次创建全部任务
+    def __init__(self, limit):
+        self.limit = limit
+        self.tasks = set()
+        self.ok = 0
+        self.total = 0
+
+    def _collect(self, done):
+        for task in done:
+            self.ok += task.result()
+            self.total += 1
+
+    async def add(self, coro):
+        if len(self.tasks) >= self.limit:
+            done, self.tasks = await asyncio.wait(self.tasks, return_when=asyncio.FIRST_COMPLETED)
+            self._collect(done)
+        self.tasks.add(asyncio.ensure_future(coro))
+
+    async def wait(self):
+        if self.tasks:
+            done, self.tasks = await asyncio.wait(self.tasks)
+            self._collect(done)
+
+
+class AsyncEngine:
+    def __init__(self, manifest, log=print, page_concurrency=PAGE_CONCURRENCY, img_concurrency=IMG_CONCURRENCY,
+                 entry_concurrency=ENTRY_CONCURRENCY, per_host=PER_HOST, store=None, emit=None):
+        if aiohttp is None:
+            raise RuntimeError("asyncio 引擎需要先安装 aiohttp：pip install aiohttp")
+        self.manifest = manifest
+        self.log = log
+        # store: store.ContentStore，为 None 时不去重
+        self.store = store
+        # emit(event, **fields)：结构化进度事件，与 pipeline 相同
+        self.emit = emit or (lambda event, **fields: None)
+        self.per_host = per_host
+        self.limit = page_concurrency + img_concurrency
+        self.page_sem = asyncio.Semaphore(page_concurrency)
+        self.img_sem = asyncio.Semaphore(img_concurrency)
+        self.entry_sem = asyncio.Semaphore(entry_concurrency)
+        self.entry_concurrency = entry_concurrency
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.per_host)
+        connect_timeout, read_timeout = transport.TIMEOUT
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = aiohttp.ClientSession(headers=transport.HEADERS, connector=connector, timeout=timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def get_html(self, url, use_cache=True):
+        cache = transport.get_page_cache() if use_cache else None
+        async with self.page_sem:
+            started = time.perf_counter()
+            try:
+                for attempt in range(transport.THROTTLE_RETRIES + 1):
+                    async with await transport.rate_limit.slot_async(url) as slot:
+                        sent = time.perf_counter()
+                        async with self.session.get(url, headers=cache.validators(url) if cache else None) as resp:
+                            metrics.REQUEST_SECONDS.observe(time.perf_counter() - sent, kind='page')
+                            metrics.REQUESTS.inc(kind='page', status=resp.status)
+                            slot.report(resp.status, resp.headers.get('Retry-After'))
+                            if slot.throttled and attempt < transport.THROTTLE_RETRIES:
+                                continue
+                            if resp.status == 304 and cache:
+                                text = cache.load(url)
+                                if text is None:
+                                    raise LookupError(url)
+                                metrics.PAGES.inc(result='cached')
+                                return text
+                            if resp.status != 200:
+                                # 与 transport.get_html 相同：错误页的内容不能当成页面解析
+                                metrics.PAGES.inc(result='empty')
+                                metrics.error('page', f'HTTP {resp.status}')
+                                return ''
+                            body = await resp.read()
+                            text = body.decode(resp.get_encoding(), errors='replace')
+                            if cache:
+                                cache.store(url, text, resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+                            metrics.PAGES.inc(result='ok')
+                            metrics.BYTES.inc(len(body), kind='page')
+                            return text
+            except LookupError:
+                pass
+            except Exception as e:
+                metrics.PAGES.inc(result='empty')
+                metrics.error('page', e)
+                return ''
+            finally:
+                metrics.PAGE_SECONDS.observe(time.perf_counter() - started)
+        # 本地副本丢失，重新完整请求
+        return await self.get_html(url, use_cache=False)
+
+    async def download_image(self, img_url, save_path, retry_range=True):
+        # 与 transport.download_file 相同：写 .part 文件，完成后原子改名，中断的 .part 用 Range 续传
+        if os.path.exists(save_path):
+            return 'skip'
+        part_path = save_path + transport.PART_SUFFIX
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+        started = time.perf_counter()
+        disk_seconds = 0.0
+        async with self.img_sem:
+            for attempt in range(transport.THROTTLE_RETRIES + 1):
+                async with await transport.rate_limit.slot_async(img_url) as slot:
+                    sent = time.perf_counter()
+                    async with self.session.get(img_url, headers=headers) as resp:
+                        metrics.REQUEST_SECONDS.observe(time.perf_counter() - sent, kind='image')
+                        metrics.REQUESTS.inc(kind='image', status=resp.status)
+                        slot.report(resp.status, resp.headers.get('Retry-After'))
+                        if slot.throttled and attempt < transport.THROTTLE_RETRIES:
+                            continue
+                        if resp.status == 416 and offset and retry_range:
+                            os.remove(part_path)
+                            retry = True
+                        else:
+                            retry = False
+                            resp.raise_for_status()
+                            start = transport.resume_offset(resp.status, resp.headers, offset)
+                            compressed = resp.headers.get('Content-Encoding', 'identity') != 'identity'
+                            expected = None
+                            if resp.content_length is not None and not compressed:
+                                expected = start + resp.content_length
+                            with open(part_path, 'ab' if start else 'wb') as f:
+                                async for chunk in resp.content.iter_chunked(transport.CHUNK_SIZE):
+                                    t = time.perf_counter()
+                                    f.write(chunk)
+                                    disk_seconds += time.perf_counter() - t
+                                    metrics.BYTES.inc(len(chunk), kind='image')
+                                    wait = transport.bandwidth_limit.reserve(len(chunk))
+                                    if wait:
+                                        await asyncio.sleep(wait)
+                break
+        if retry:
+            return await self.download_image(img_url, save_path, retry_range=False)
+        size = os.path.getsize(part_path)
+        if expected is not None and size != expected:
+            raise IOError(f"下载不完整：{size}/{expected} 字节")
+        t = time.perf_counter()
+        os.replace(part_path, save_path)
+        metrics.DISK_SECONDS.inc(disk_seconds + time.perf_counter() - t)
+        metrics.IMAGE_SECONDS.observe(time.perf_counter() - started)
+        return 'ok'
+
+    async def _download_one(self, entry_url, idx, img_url, save_path):
+        name = os.path.basename(save_path)
+        try:
+            if self.store and not os.path.exists(save_path) and self.store.link_known(img_url, save_path):
+                result = 'linked'
+            else:
+                result = await self.download_image(img_url, save_path)
+                if self.store and (result != 'skip' or self.manifest.blob_for_url(img_url) is None):
+                    await asyncio.to_thread(self.store.ingest, save_path, img_url)
+        except Exception as e:
+            self.manifest.mark_image(entry_url, idx, FAILED)
+            metrics.error('image', e)
+            self.log(f"图片下载失败: {img_url}，原因：{e}")
+            self.emit('image', entry=entry_url, idx=idx, img_url=img_url, path=save_path, status='failed',
+                      error=str(e))
+            return False
+        size = os.path.getsize(save_path)
+        self.manifest.mark_image(entry_url, idx, DONE, size)
+        self.emit('image', entry=entry_url, idx=idx, img_url=img_url, path=save_path,
+                  status=result if result in ('skip', 'linked') else 'ok', bytes=size)
+        if result == 'skip':
+            self.log(f"{name} 已存在，跳过。")
+        elif result == 'linked':
+            self.log(f"{name} 与已下载的图片相同，直接链接。")
+        else:
+            self.log(f"下载 {name} : {img_url}")
+        return True
+
+    async def process_entry(self, entry_url, base_save_dir):
+        # 完成情况以清单为准：已完成的条目不发请求，分页齐全的条目只补缺失图片；返回 DONE 或 PARTIAL
+        entry = self.manifest.get_entry(entry_url)
+        if entry and entry['status'] == DONE:
+            self.log(f"【已完成】{entry['title']}（共{self.manifest.image_count(entry_url)}张），跳过下载。")
+            self.emit('entry_done', url=entry_url, title=entry['title'], status='skipped',
+                      images=self.manifest.image_count(entry_url), missing=0)
+            return DONE
+        jobs = _Jobs(PENDING_IMAGES)
+        if entry and self.manifest.pages_complete(entry_url):
+            title, save_dir = entry['title'], entry['save_dir']
+            os.makedirs(save_dir, exist_ok=True)
+            missing = self.manifest.missing_count(entry_url)
+            self.log(f"【续传】{title} 缺失{missing}张，保存到 {save_dir}")
+            self.emit('entry_start', url=entry_url, title=title, save_dir=save_dir, resume=True, missing=missing)
+            for img in self.manifest.images(entry_url):
+                if img['status'] != DONE:
+                    await jobs.add(self._download_one(entry_url, img['idx'], img['url'], img['path']))
+        else:
+            html = await self.get_html(entry_url)
+            if not html:
+                raise RuntimeError("条目页请求失败")
+            title, end_page, first_page_imgs = parse_entry_page(html, use_head_title=True, entry_url=entry_url)
+            end_page = await asyncio.to_thread(pagecount.resolve, entry_url, end_page, self.manifest, self.log)
+            save_dir = os.path.join(base_save_dir, title, 'images')
+            os.makedirs(save_dir, exist_ok=True)
+            self.manifest.save_entry(entry_url, title, save_dir, end_page)
+            self.log(f"【开始】{title} 共{end_page}页，保存到 {save_dir}")
+            self.emit('entry_start', url=entry_url, title=title, save_dir=save_dir, pages=end_page)
+            count = 0
+            # 分页边到边处理：每页提取出图片就开始下载，不等所有分页取完
+            async for page, page_html in self._iter_pages(lambda page: f"{entry_url}/{page}", 2, end_page, html):
+                records = []
+                imgs = first_page_imgs if page == 1 else get_image_urls_from_page(page_html)
+                for img_url in imgs:
+                    img_url = complete_img_url(img_url)
+                    count += 1
+                    records.append((count, img_url, image_save_path(save_dir, count, img_url)))
+                # 与线程引擎相同：请求失败或没有图片的分页都记为失败，条目不会被当成已完成
+                if not page_html:
+                    self.log(f"第{page}页请求失败")
+                elif not imgs:
+                    self.log(f"第{page}页未找到图片")
+                for stale_path in self.manifest.record_page(entry_url, page, records, bool(imgs)):
+                    if os.path.exists(stale_path):
+                        os.remove(stale_path)
+                for idx, img_url, save_path in records:
+                    if self.manifest.image_status(entry_url, idx) != DONE:
+                        await jobs.add(self._download_one(entry_url, idx, img_url, save_path))
+            self.manifest.trim_images(entry_url, count)
+        await jobs.wait()
+        ok, total = jobs.ok, jobs.total
+        done = self.manifest.finish_entry(entry_url)
+        if done:
+            self.log(f"【完成】{title} ：共{self.manifest.image_count(entry_url)}张图片，已保存在 {save_dir}")
+        else:
+            self.log(f"【未完成】{title} ：本次成功{ok}张，失败{total - ok}张，"
+                     f"缺失{self.manifest.missing_count(entry_url)}张，已保存在 {save_dir}")
+        self.emit('entry_done', url=entry_url, title=title, status=DONE if done else PARTIAL,
+                  images=self.manifest.image_count(entry_url), missing=self.manifest.missing_count(entry_url))
+        return DONE if done else PARTIAL
+
+    async def _process_entry_guarded(self, entry_url, entry_name, base_save_dir, category_url=None):
+        async with self.entry_sem:
+            self.log(f"\n开始处理：{entry_name} - {entry_url}")
+            status = None
+            try:
+                status = await self.process_entry(entry_url, base_save_dir)
+            except Exception as e:
+                metrics.error('entry', e)
+                self.log(f"处理失败：{entry_name}，原因：{e}")
+                self.emit('entry_failed', url=entry_url, error=str(e))
+            # 这个引擎不记录重试，只有完成的条目才记为已处理，未完成的下次增量扫描还会遇到
+            if category_url and status == DONE:
+                self.manifest.remember_entry(category_url, entry_url)
+            limits = transport.rate_limit.describe(throttled_only=True)
+            if limits:
+                self.log(f"当前限流：{limits}")
+
+    async def _iter_pages(self, page_url, first, last, first_html=None):
+        # 异步生成器：按页码顺序产出 (页码, HTML)，最多预取 PAGE_PREFETCH 页
+        # first_html 不为空时先产出已取到的第 first-1 页；调用方提前结束时取消还没用上的预取
+        if first_html is not None:
+            yield first - 1, first_html
+        pending = collections.deque()
+        page = first
+        try:
+            while page <= last or pending:
+                while page <= last and len(pending) < PAGE_PREFETCH:
+                    pending.append((page, asyncio.ensure_future(self.get_html(page_url(page)))))
+                    page += 1
+                number, task = pending.popleft()
+                yield number, await task
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def _listing_entries(self, page_url, entries, expected):
+        # 与 core._listing_entries 相同：条目数少于 expected 时重试，重试后仍一个条目都没有返回 None
+        best = entries
+        for attempt in range(LISTING_RETRIES):
+            if best and len(best) >= expected:
+                break
+            await asyncio.sleep(LISTING_RETRY_DELAY * 2 ** attempt)
+            entries = get_entries_from_page(await self.get_html(page_url))
+            if len(entries) > len(best):
+                best = entries
+        return best or None
+
+    async def crawl_category(self, base_url, save_dir, incremental=False):
+        # 列表页按顺序预取，每页的条目放进有界队列，由 entry_concurrency 个协程边取边处理
+        # 增量模式遇到整页都是已处理过的条目就停止
+        self.log(f"开始解析分类首页：{base_url}")
+        html = await self.get_html(base_url)
+        if not html:
+            self.log("无法获取首页HTML，请检查网络或URL。")
+            self.emit('category_failed', url=base_url)
+            return
+        first_page = extract_page(html)
+        total_pages = first_page.total_pages
+        self.log(f"发现分类总页数：{total_pages}")
+        entries_q = asyncio.Queue(self.entry_concurrency)
+
+        async def worker():
+            while (item := await entries_q.get()) is not None:
+                await self._process_entry_guarded(item[0], item[1], save_dir, base_url)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.entry_concurrency)]
+        count = 0
+        seen = set()
+        try:
+            page_url = lambda i: urljoin(base_url, f"page/{i}/")
+            pages = self._iter_pages(page_url, 2, total_pages, html)
+            async for i, page_html in pages:
+                if i == 1:
+                    entries = first_page.entries
+                else:
+                    # 除最后一页外每页的条目数应与首页相同
+                    expected = len(first_page.entries) if i < total_pages else 0
+                    entries = await self._listing_entries(page_url(i), get_entries_from_page(page_html), expected)
+                    if entries is None:
+                        self.log(f"第{i}页列表获取失败（已重试{LISTING_RETRIES}次）：{page_url(i)}")
+                        self.emit('listing_failed', url=page_url(i), category=base_url, page=i)
+                        if incremental:
+                            self.log(f"增量扫描在第{i}页停止，其后的列表页本次不再扫描")
+                            await pages.aclose()
+                            break
+                        continue
+                self.log(f"第{i}页提取到{len(entries)}个条目")
+                if incremental and self.manifest.all_known(base_url, (url for url, _ in entries)):
+                    self.log(f"第{i}页的条目都已处理过，增量扫描结束")
+                    await pages.aclose()
+                    break
+                # 扫描期间条目可能在相邻页之间移动，同一地址只处理一次
+                fresh = [(url, name) for url, name in entries if url not in seen]
+                seen.update(url for url, _ in fresh)
+                if len(fresh) < len(entries):
+                    self.log(f"第{i}页有{len(entries) - len(fresh)}个条目在前面的页出现过，已跳过")
+                for entry in fresh:
+                    await entries_q.put(entry)
+                    count += 1
+        finally:
+            for _ in workers:
+                await entries_q.put(None)
+            await asyncio.gather(*workers)
+        self.log(f"总共处理{count}个条目")
+        self.emit('category', url=base_url, pages=total_pages, entries=count)
+
+
+def run_urls(urls, save_dir, log=print, incremental=False, use_store=False, emit=None, **options):
+    # 同步入口：在当前线程里跑一个事件循环，依次处理条目页和分类首页地址
+    async def main():
+        async with AsyncEngine(manifest, log, store=store, emit=emit, **options) as engine:
+            for url in urls:
+                if is_entry_url(url):
+                    await engine._process_entry_guarded(url, url, save_dir)
+                else:
+                    await engine.crawl_category(url, save_dir, incremental)
+    manifest = Manifest.for_dir(save_dir)
+    store = ContentStore.for_dir(save_dir, manifest) if use_store else None
+    try:
+        asyncio.run(main())
+        if store:
+            log("去重报告：\n" + store.report())
+    finally:
+        manifest.close()
+
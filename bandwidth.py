@@ -0,0 +1,162 @@
+# 全局带宽限制：令牌桶限制图片下载的总字节速率，同时运行的任务(份额)按权重分配带宽
+# 速率和权重都可以在运行中修改；速率为 0 表示不限速
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# 令牌桶容量(按秒计的突发量)：限速后短时间内最多超出这么多秒的额度
+BURST_SECONDS = 0.5
+# 份额多久没有下载就不再参与分配(秒)，它的带宽让给其他任务
+ACTIVE_SECONDS = 2.0
+# 限速文件的检查间隔(秒)
+RATE_FILE_INTERVAL = 2.0
+_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+_local = threading.local()
+
+
+def parse_rate(text):
+    # '500K'、'2M'、'1.5m'、'1048576' -> 字节/秒；空串、0、off 表示不限速
+    text = str(text).strip().upper().removesuffix('/S').removesuffix('B')
+    if text in ('', '0', 'OFF', 'NONE'):
+        return 0
+    m = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMG]?)', text)
+    if not m:
+        raise ValueError(f"无法识别的速率：{text}")
+    return int(float(m.group(1)) * _UNITS[m.group(2)])
+
+
+def format_rate(rate):
+    if not rate:
+        return '不限速'
+    if rate >= 1024 ** 2:
+        return f'{rate / 1024 ** 2:.1f}MB/秒'
+    return f'{rate / 1024:.0f}KB/秒'
+
+
+def current_share():
+    return getattr(_local, 'share', None)
+
+
+@contextmanager
+def share(key):
+    # 在当前线程内把下载计入份额 key；DownloadPool 提交任务时记下份额，下载线程里沿用
+    previous = current_share()
+    _local.share = key
+    try:
+        yield
+    finally:
+        _local.share = previous
+
+
+class _Bucket:
+    # 允许欠账的令牌桶：取走令牌后余额为负时返回需要等待的秒数
+    def __init__(self):
+        self.tokens = 0.0
+        self.stamp = time.monotonic()
+        self.last_used = 0.0
+
+    def take(self, nbytes, rate, now):
+        self.tokens = min(rate * BURST_SECONDS, self.tokens + (now - self.stamp) * rate)
+        self.stamp = now
+        self.last_used = now
+        self.tokens -= nbytes
+        return max(0.0, -self.tokens / rate)
+
+
+class Governor:
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._total = _Bucket()
+        self._shares = {}
+        self._weights = {}
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = max(0, int(rate))
+
+    def set_weight(self, key, weight):
+        # 权重越大分到的带宽越多，默认 1
+        with self._lock:
+            self._weights[key] = max(weight, 0.01)
+
+    def remove(self, key):
+        with self._lock:
+            self._shares.pop(key, None)
+            self._weights.pop(key, None)
+
+    def reserve(self, nbytes, key=None):
+        # 记下 nbytes 的用量，返回调用方应等待的秒数；asyncio 引擎用它配合 asyncio.sleep
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            rate = self.rate
+            wait = self._total.take(nbytes, rate, now)
+            if key is None:
+                return wait
+            bucket = self._shares.get(key)
+            if bucket is None:
+                bucket = self._shares[key] = _Bucket()
+            # 份额的速率 = 总速率 × 自己的权重 / 最近在下载的各份额权重之和
+            active = sum(self._weights.get(k, 1) for k, b in self._shares.items()
+                         if k == key or now - b.last_used < ACTIVE_SECONDS)
+            share_rate = rate * self._weights.get(key, 1) / active
+            return max(wait, bucket.take(nbytes, share_rate, now))
+
+    def consume(self, nbytes):
+        # 在下载线程中调用：按当前线程的份额记账，超出速率时睡眠
+        wait = self.reserve(nbytes, current_share())
+        if wait:
+            time.sleep(wait)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return {'rate': self.rate,
+                    'active': {k: self._weights.get(k, 1) for k, b in self._shares.items()
+                               if now - b.last_used < ACTIVE_SECONDS}}
+
+
+class RateFile:
+    # 命令行运行中调整限速：定期读取文件里的速率(如 "2M")，内容变化时更新 governor
+    # 多个工作进程读同一个文件时 parts 为进程数，各进程平分文件里的速率
+    def __init__(self, path, governor, log=print, interval=RATE_FILE_INTERVAL, parts=1):
+        self.path = path
+        self.governor = governor
+        self.parts = parts
+        self.log = log
+        self.interval = interval
+        self._mtime = None
+        self._stop = threading.Event()
+        self._check()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _check(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            with open(self.path, encoding='utf-8') as f:
+                rate = parse_rate(f.read()) // self.parts
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.log(f"读取限速文件失败：{self.path}，原因：{e}")
+            return
+        if rate != self.governor.rate:
+            self.governor.set_rate(rate)
+            self.log(f"限速调整为 {format_rate(rate)}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._check()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
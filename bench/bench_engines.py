@@ -0,0 +1,140 @@
+# 下载引擎压测：用本地替身服务器跑完整个分类，输出每个引擎的 条目/秒、张/秒、MB/秒
+# python bench/bench_engines.py --latency 0.05 --listing-pages 4 --bandwidth 2000000 --error-rate 0.02
+# 新引擎加到 ENGINES 里即可参与对比
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import core
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
+
+
+def image_files(path):
+    # 重试补下的图片不发 image 进度事件，图片数和字节数按磁盘上的文件统计
+    sizes = [os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files
+             if name.lower().endswith(IMAGE_EXTS)]
+    return len(sizes), sum(sizes)
+
+
+def run_threads(url, save_dir, args, progress):
+    return core.run([url], save_dir, log=lambda msg: None, progress=progress, workers=args.workers,
+                    use_cache=False, retry_wait=args.retry_wait)
+
+
+def run_write_behind(url, save_dir, args, progress):
+    return core.run([url], save_dir, log=lambda msg: None, progress=progress, workers=args.workers,
+                    use_cache=False, retry_wait=args.retry_wait, write_behind=True)
+
+
+def run_asyncio(url, save_dir, args, progress):
+    return core.run([url], save_dir, log=lambda msg: None, progress=progress, backend='asyncio', use_cache=False)
+
+
+def run_queue(url, save_dir, args, progress):
+    # 协调者入队后由一个工作进程领取下载(同一进程内)，衡量工作队列本身的开销
+    core.enqueue([url], save_dir, log=lambda msg: None, use_cache=False)
+    return core.work(save_dir, log=lambda msg: None, progress=progress, workers=args.workers, use_cache=False,
+                     retry_wait=args.retry_wait)
+
+
+ENGINES = {'threads': run_threads, 'writebehind': run_write_behind, 'asyncio': run_asyncio, 'queue': run_queue}
+
+
+def bench(name, url, args):
+    # 返回一次完整运行的结果，数字取自 core 的进度事件
+    # 重试补齐的条目会再收到一次 entry_done，条目数按每个条目最后的状态计
+    summary, entry_status = {}, {}
+
+    def progress(event):
+        if event['event'] == 'summary':
+            summary.update(event)
+        elif event['event'] == 'entry_done':
+            entry_status[event['url']] = event['status']
+
+    save_dir = tempfile.mkdtemp(prefix=f'bench_{name}_')
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ENGINES[name](url, save_dir, args, progress)
+        elapsed = time.perf_counter() - start
+        images, size = image_files(save_dir)
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+    entries = sum(1 for status in entry_status.values() if status in ('done', 'skipped'))
+    size = size / 1024 / 1024
+    return {'engine': name, 'seconds': round(elapsed, 3), 'entries': entries, 'images': images,
+            'mb': round(size, 2), 'entries_per_s': round(entries / elapsed, 2),
+            'images_per_s': round(images / elapsed, 1), 'mb_per_s': round(size / elapsed, 2),
+            'unfinished': len(entry_status) - entries + summary.get('entries_failed', 0),
+            'remaining': summary.get('remaining', 0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载引擎压测')
+    parser.add_argument('--port', type=int, default=8178)
+    parser.add_argument('--listing-pages', type=int, default=3)
+    parser.add_argument('--entries-per-page', type=int, default=8)
+    parser.add_argument('--entry-pages', type=int, default=4)
+    parser.add_argument('--imgs-per-page', type=int, default=5)
+    parser.add_argument('--img-size', type=int, default=32 * 1024)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--bandwidth', type=int, default=0, help='替身服务器每个响应的速度(字节/秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='替身服务器返回 503 的比例')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='替身服务器传一半断开的比例')
+    parser.add_argument('--seed', type=int, default=177, help='随机错误的种子')
+    parser.add_argument('--engines', default='threads,asyncio', help='逗号分隔：' + ','.join(ENGINES))
+    parser.add_argument('--repeat', type=int, default=1, help='每个引擎运行次数，取最快的一次')
+    parser.add_argument('--workers', type=int, default=8, help='线程引擎的下载线程数')
+    parser.add_argument('--retry-wait', type=float, default=30, help='线程引擎结束前等待自动重试的秒数')
+    parser.add_argument('--json', help='结果另存为 JSON 文件，便于比较不同版本')
+    args = parser.parse_args()
+    names = [n for n in args.engines.split(',') if n]
+    unknown = [n for n in names if n not in ENGINES]
+    if unknown:
+        parser.error(f"未知引擎：{','.join(unknown)}")
+
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, 'mock_server.py'),
+                               '--port', str(args.port),
+                               '--listing-pages', str(args.listing_pages),
+                               '--entries-per-page', str(args.entries_per_page),
+                               '--entry-pages', str(args.entry_pages),
+                               '--imgs-per-page', str(args.imgs_per_page),
+                               '--img-size', str(args.img_size),
+                               '--latency', str(args.latency),
+                               '--bandwidth', str(args.bandwidth),
+                               '--error-rate', str(args.error_rate),
+                               '--drop-rate', str(args.drop_rate),
+                               '--seed', str(args.seed)],
+                              stdout=subprocess.PIPE, text=True)
+    results = []
+    try:
+        server.stdout.readline()
+        url = f"http://127.0.0.1:{args.port}/cat/"
+        print(f"{'引擎':11s} {'用时':>8s} {'条目':>5s} {'图片':>6s} {'条目/秒':>8s} {'张/秒':>8s} {'MB/秒':>8s} {'未完成':>5s}")
+        for name in names:
+            best = min((bench(name, url, args) for _ in range(args.repeat)), key=lambda r: r['seconds'])
+            results.append(best)
+            print(f"{name:12s} {best['seconds']:7.2f}s {best['entries']:6d} {best['images']:7d} "
+                  f"{best['entries_per_s']:10.2f} {best['images_per_s']:9.1f} {best['mb_per_s']:9.2f} "
+                  f"{best['unfinished']:6d}")
+    finally:
+        server.terminate()
+        server.wait()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# 解析微基准：旧的 BeautifulSoup + etree 双重解析 vs extract 模块单次 lxml 解析
+# python bench/bench_extract.py [--number 200]
+import argparse
+import os
+import re
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import extract
+
+try:
+    import bs4
+except ImportError:  # 只有对比旧版解析时才需要 bs4，下载器本身已经不依赖它
+    bs4 = None
+
+SAMPLES = os.path.join(HERE, 'samples')
+
+
+def legacy_entry(html):
+    # 旧版 get_entry_detail：BeautifulSoup 取标题和分页，再用 etree 取图片
+    from bs4 import BeautifulSoup
+    from lxml import etree
+    soup = BeautifulSoup(html, "lxml")
+    title_tag = soup.find(class_="entry-title")
+    title = extract.sanitize_filename(title_tag.get_text(strip=True)) if title_tag else "UnknownEntry"
+    pagination = soup.find('div', class_='page-links')
+    end_page = 1
+    if pagination:
+        page_numbers = [int(a.get_text()) for a in pagination.find_all('a') if a.get_text().isdigit()]
+        if page_numbers:
+            end_page = max(page_numbers)
+    ele = etree.HTML(html)
+    img_urls = ele.xpath("//div[@class='single-content']//img/@data-lazy-src")
+    if not img_urls:
+        img_urls = ele.xpath("//div[@class='single-content']//img/@src")
+    return title, end_page, img_urls
+
+
+def legacy_listing(html):
+    # 旧版 download_main 首页：get_total_pages 和 get_entries_from_page 各解析一次
+    from bs4 import BeautifulSoup
+    max_page = 1
+    for link in BeautifulSoup(html, "lxml").select('a.page-numbers'):
+        m = re.search(r'/page/(\d+)/', link.get('href', ''))
+        if m:
+            max_page = max(max_page, int(m.group(1)))
+    entries = []
+    for h2 in BeautifulSoup(html, "lxml").select("h2.grid-title"):
+        a = h2.find('a')
+        if a and a.get('href'):
+            entries.append((a['href'], a.get_text(strip=True)))
+    return max_page, entries
+
+
+def legacy_comic(html):
+    # 旧版 comic_downloader：html.parser 取标题和分页，再用 etree 取图片
+    from bs4 import BeautifulSoup
+    from lxml import etree
+    soup = BeautifulSoup(html, 'html.parser')
+    title_tag = soup.find('h1', class_='entry-title')
+    pagination = soup.find('div', class_='page-links')
+    ele = etree.HTML(html)
+    return title_tag, pagination, ele.xpath("//div[@class='single-content']//img/@data-lazy-src")
+
+
+def new_entry(html):
+    return extract.parse_entry_page(html)
+
+
+def new_listing(html):
+    page = extract.extract_page(html)
+    return page.total_pages, page.entries
+
+
+def read_sample(name):
+    with open(os.path.join(SAMPLES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='页面解析微基准')
+    parser.add_argument('--number', type=int, default=200, help='每项重复次数')
+    args = parser.parse_args()
+
+    entry_html = read_sample('entry.html')
+    listing_html = read_sample('listing.html')
+    cases = [
+        ('条目页 extract', new_entry, entry_html),
+        ('列表页 extract', new_listing, listing_html),
+    ]
+    if bs4 is None:
+        print("未安装 bs4，跳过旧版解析的对比")
+    else:
+        assert legacy_entry(entry_html) == new_entry(entry_html)
+        assert legacy_listing(listing_html) == new_listing(listing_html)
+        cases = [
+            ('条目页 bs4(lxml)+etree', legacy_entry, entry_html),
+            ('条目页 bs4(html.parser)+etree', legacy_comic, entry_html),
+            cases[0],
+            ('列表页 bs4 x2', legacy_listing, listing_html),
+            cases[1],
+        ]
+    for name, fn, html in cases:
+        best = min(timeit.repeat(lambda: fn(html), number=args.number, repeat=3)) / args.number
+        print(f"{name:32s} {best * 1000:8.3f} ms/页")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# 启动耗时基准：每个入口脚本顶层 import 的耗时(python -X importtime)，每次都在新进程里冷启动
+# python bench/bench_startup.py [--repeat 5] [--json startup.json]
+# 图形界面脚本在模块顶层就建窗口，这里只执行它们顶层的 import 语句；命令行另测一次完整的 --help
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+ENTRY_POINTS = ('177cli.py', '177down.py', '177allwindow.py', '177down(window).py', '177down(window)v2.0.py')
+# 每个入口列出的最慢的顶层模块数
+TOP = 5
+
+
+def import_code(script):
+    # 取出脚本模块顶层的 import 语句，原样拼成一段代码
+    with open(os.path.join(ROOT, script), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    nodes = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+    return '\n'.join(ast.unparse(node) for node in nodes)
+
+
+def parse_importtime(stderr):
+    # 返回 {顶层模块: 累计微秒}；-X importtime 每行为 "import time: 自身 | 累计 | 缩进+模块名"
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        # 顶层模块前只有一个空格，被它间接导入的模块缩进更深
+        if name.startswith(' ') and not name.startswith('   '):
+            modules[name.strip()] = int(parts[1])
+    return modules
+
+
+def run_once(args, exclude=()):
+    # exclude：空解释器启动时(site 等)就会导入的模块，不算在入口头上
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f'退出码 {proc.returncode}')
+    modules = parse_importtime(proc.stderr)
+    return elapsed, {m: us for m, us in modules.items() if m not in exclude}
+
+
+def bench(name, args, repeat, baseline, exclude):
+    # 多次冷启动取中位数；wall 扣除空解释器的启动时间，imports 为本入口顶层模块的导入耗时合计
+    walls, totals, runs = [], [], []
+    for _ in range(repeat):
+        wall, modules = run_once(args, exclude)
+        walls.append(wall)
+        totals.append(sum(modules.values()) / 1000)
+        runs.append(modules)
+    modules = runs[totals.index(statistics.median_low(totals))]
+    slowest = sorted(modules.items(), key=lambda item: -item[1])[:TOP]
+    return {'entry': name, 'wall_ms': round((statistics.median(walls) - baseline) * 1000, 1),
+            'imports_ms': round(statistics.median(totals), 1),
+            'slowest': [(module, round(us / 1000, 1)) for module, us in slowest]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='入口脚本启动耗时基准')
+    parser.add_argument('--repeat', type=int, default=5, help='每个入口冷启动次数，取中位数')
+    parser.add_argument('--json', help='结果另存为 JSON 文件，便于比较不同版本')
+    args = parser.parse_args()
+
+    site_modules = run_once(['-c', 'pass'])[1]
+    baseline = statistics.median(run_once(['-c', 'pass'])[0] for _ in range(args.repeat))
+    cases = [(script, ['-c', import_code(script)]) for script in ENTRY_POINTS]
+    cases.append(('177cli.py --help', [os.path.join(ROOT, '177cli.py'), '--help']))
+    results = []
+    print(f"{'入口':28s} {'启动(ms)':>9s} {'导入(ms)':>9s}  最慢的顶层模块(ms)")
+    for name, cmd in cases:
+        try:
+            result = bench(name, cmd, args.repeat, baseline, site_modules)
+        except RuntimeError as e:
+            print(f"{name:28s} 运行失败：{e}")
+            continue
+        results.append(result)
+        print(f"{name:28s} {result['wall_ms']:9.1f} {result['imports_ms']:9.1f}  "
+              + ', '.join(f"{m} {ms}" for m, ms in result['slowest']))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version, 'baseline_ms': round(baseline * 1000, 1), 'results': results}, f,
+                      ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# 本地 177pica 替身服务器，用于离线压测下载引擎
+# 分类列表: /cat/  /cat/page/N/    条目: /html/ID.html  /html/ID.html/N    图片: //HOST/img/ID_N_K.jpg
+# 可模拟延迟、每个连接的带宽、随机 503 和传输中途断开
+import argparse
+import hashlib
+import random
+import re
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 限速时每次写出的块大小
+WRITE_CHUNK = 16 * 1024
+
+
+class MockConfig:
+    # bandwidth: 每个响应的传输速度(字节/秒)，0 为不限速
+    # error_rate: 返回 503 的请求比例；drop_rate: 正文只发一半就断开连接的比例(测试续传)
+    # page_links 为 False 时条目页不带分页栏，用来测试分页数探测
+    def __init__(self, listing_pages=2, entries_per_page=4, entry_pages=3, imgs_per_page=4,
+                 img_size=32 * 1024, latency=0.05, bandwidth=0, error_rate=0.0, drop_rate=0.0, seed=None,
+                 page_links=True):
+        self.listing_pages = listing_pages
+        self.entries_per_page = entries_per_page
+        self.entry_pages = entry_pages
+        self.imgs_per_page = imgs_per_page
+        self.img_size = img_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.page_links = page_links
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 头部和正文分两次写出，keep-alive 连接上要关掉 Nagle，否则每个请求多等一个延迟 ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def write_body(self, body):
+            # 按 drop_rate 只写一半就断开；按 bandwidth 分块限速写出；HEAD 请求不写正文
+            if self.command == 'HEAD':
+                return
+            if body and config.drop_rate and config.random.random() < config.drop_rate:
+                body = body[:len(body) // 2]
+                self.close_connection = True
+            if not config.bandwidth:
+                self.wfile.write(body)
+                return
+            start = time.perf_counter()
+            for i in range(0, len(body), WRITE_CHUNK):
+                self.wfile.write(body[i:i + WRITE_CHUNK])
+                delay = start + (i + WRITE_CHUNK) / config.bandwidth - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+        def send(self, body, ctype='text/html; charset=utf-8', code=200):
+            self.send_response(code)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.write_body(body)
+
+        def send_image(self, body):
+            # 支持 Range: bytes=N- 续传
+            m = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+            if not m:
+                return self.send(body, 'image/jpeg')
+            start = int(m.group(1))
+            if start >= len(body):
+                return self.send(b'', code=416)
+            self.send_response(206)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+            self.send_header('Content-Length', str(len(body) - start))
+            self.end_headers()
+            self.write_body(body[start:])
+
+        def send_page(self, body):
+            # HTML 页面带 ETag，支持 If-None-Match 条件请求
+            etag = '"%s"' % hashlib.md5(body).hexdigest()[:16]
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.write_body(body)
+
+        def do_GET(self):
+            time.sleep(config.latency)
+            if config.error_rate and config.random.random() < config.error_rate:
+                return self.send(b'service unavailable', code=503)
+            root = f"http://{self.headers['Host']}"
+            m = re.match(r'^/cat/(?:page/(\d+)/)?$', self.path)
+            if m:
+                return self.send_page(listing_page(config, root, int(m.group(1) or 1)))
+            m = re.match(r'^/html/(\d+)\.html(?:/(\d+))?$', self.path)
+            if m and int(m.group(2) or 1) <= config.entry_pages:
+                return self.send_page(entry_page(config, root, m.group(1), int(m.group(2) or 1)))
+            if self.path.startswith('/img/'):
+                return self.send_image(image_body(config, self.path))
+            self.send(b'not found', code=404)
+
+        do_HEAD = do_GET
+
+    return Handler
+
+
+def listing_page(config, root, page):
+    items = ''.join(
+        f'<h2 class="grid-title"><a href="{root}/html/{page * 1000 + i}.html">漫画{page}-{i}</a></h2>'
+        for i in range(config.entries_per_page))
+    nav = ''.join(f'<a class="page-numbers" href="{root}/cat/page/{p}/">{p}</a>'
+                  for p in range(1, config.listing_pages + 1))
+    return f'<html><body>{items}<nav>{nav}</nav></body></html>'.encode('utf-8')
+
+
+def entry_page(config, root, entry_id, page):
+    host = root.split('//', 1)[1]
+    imgs = ''.join(f'<p><img data-lazy-src="//{host}/img/{entry_id}_{page}_{k}.jpg"></p>'
+                   for k in range(config.imgs_per_page))
+    links = ''.join(f'<a href="{root}/html/{entry_id}.html/{p}">{p}</a>'
+                    for p in range(2, config.entry_pages + 1))
+    # 没有分页栏时放一些干扰数字(年份、文章 ID)，旧的"整页最大数字"做法会把它们当成页数
+    nav = (f'<div class="page-links">{links}</div>' if config.page_links else
+           f'<a href="{root}/html/2025/05/{entry_id}0000.html">上一篇</a><span>2025/05/</span>')
+    return (f'<html><head><title>{entry_id}</title></head><body>'
+            f'<h1 class="entry-title">漫画 {entry_id}</h1>'
+            f'<div class="single-content">{imgs}</div>'
+            f'{nav}</body></html>').encode('utf-8')
+
+
+def image_body(config, path):
+    seed = path.encode()
+    return (b'\xff\xd8' + seed * (config.img_size // len(seed) + 1))[:config.img_size]
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 模拟断开或客户端提前关闭连接时不打印异常栈
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_server(config, host='127.0.0.1', port=0):
+    return MockServer((host, port), make_handler(config))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 177pica 替身服务器')
+    parser.add_argument('--port', type=int, default=8177)
+    parser.add_argument('--listing-pages', type=int, default=2)
+    parser.add_argument('--entries-per-page', type=int, default=4)
+    parser.add_argument('--entry-pages', type=int, default=3)
+    parser.add_argument('--imgs-per-page', type=int, default=4)
+    parser.add_argument('--img-size', type=int, default=32 * 1024)
+    parser.add_argument('--latency', type=float, default=0.05, help='每个请求的延迟(秒)')
+    parser.add_argument('--bandwidth', type=int, default=0, help='每个响应的传输速度(字节/秒)，0 为不限速')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 503 的请求比例')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='正文传一半就断开连接的比例')
+    parser.add_argument('--seed', type=int, help='随机错误的种子，指定后每次运行出错的顺序相同')
+    parser.add_argument('--no-page-links', action='store_true', help='条目页不带分页栏')
+    args = parser.parse_args()
+    config = MockConfig(args.listing_pages, args.entries_per_page, args.entry_pages,
+                        args.imgs_per_page, args.img_size, args.latency, args.bandwidth,
+                        args.error_rate, args.drop_rate, args.seed, not args.no_page_links)
+    server = make_server(config, port=args.port)
+    print(f"mock 177pica 已启动：http://127.0.0.1:{server.server_address[1]}/cat/", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+# 下载核心：条目下载、分类抓取、图片下载和失败重试，不依赖图形界面
+# 三个窗口脚本和命令行 177cli.py 都通过 run() 或 Downloader 调用这里
+import os
+import socket
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from urllib.parse import urljoin
+import transport
+from transport import get_html
+from extract import extract_page, get_entries_from_page, is_entry_url
+from pool import DownloadPool
+from manifest import Manifest
+from pagecache import PageCache
+from retry import RetryScheduler, PAGE, FAILED_TXT
+from store import ContentStore
+from writer import WriteBehind, FSYNC_NONE, FSYNC_POLICIES
+from workqueue import WorkQueue, worker_id, QUEUED, LEASED
+import pipeline
+import metrics
+
+# 图片下载线程数 / 单个主机最大并发
+IMG_WORKERS = 8
+IMG_PER_HOST = 4
+# 下载引擎：threads 为线程池 + requests，asyncio 为单线程协程引擎(需要 aiohttp)
+BACKENDS = ('threads', 'asyncio')
+# 页面缓存目录(位于保存目录下)
+PAGE_CACHE_DIR = '.pagecache'
+# 全部条目处理完后最多再等多少秒让后台重试完成(秒)，剩下的留到下次运行
+RETRY_WAIT = 600
+# 工作进程没领到条目时隔多久再查一次队列(秒)
+QUEUE_POLL = 5
+# 分类列表页的并发请求数 / 最多提前解析的页数(只保存条目地址，内存占用很小)
+LISTING_WORKERS = 4
+LISTING_PREFETCH = 32
+# 列表页请求失败、一个条目都没解析出或比首页少(可能被截断)时的重试次数 / 首次重试前等待的秒数(之后每次翻倍)
+LISTING_RETRIES = 2
+LISTING_RETRY_DELAY = 5
+
+
+def _listing_entries(page_url, expected=0):
+    # 在列表页线程中执行：请求并解析一页列表，条目数少于 expected 时重试
+    # 重试用完后返回解析出最多条目的一次，一个条目都没有时返回 None
+    best = []
+    for attempt in range(LISTING_RETRIES + 1):
+        if attempt:
+            time.sleep(LISTING_RETRY_DELAY * 2 ** (attempt - 1))
+        entries = get_entries_from_page(get_html(page_url))
+        if entries and len(entries) >= expected:
+            return entries
+        if len(entries) > len(best):
+            best = entries
+    return best or None
+
+
+def iter_entries(base_url, first_page, log=print, manifest=None, incremental=False, workers=LISTING_WORKERS,
+                 prefetch=LISTING_PREFETCH, emit=None):
+    # 逐页产出条目列表：后面的列表页由 workers 个线程提前并发请求和解析，最多领先 prefetch 页，
+    # 仍按页码顺序产出，每页解析完就交给调用方，不等整个分类扫描结束
+    # 首页已经解析过不再重复请求；增量模式遇到整页都是已处理过的条目就停止
+    # 扫描期间站点更新会让条目在相邻页之间移动，同一地址只产出一次
+    # 重试后仍取不到的列表页发出 listing_failed 事件；增量模式下在这一页停止，不越过它继续扫描
+    seen = set()
+    pending = deque()
+    next_page = 2
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='listing')
+
+    def refill():
+        nonlocal next_page
+        while next_page <= first_page.total_pages and len(pending) < prefetch:
+            # 除最后一页外每页的条目数应与首页相同
+            expected = len(first_page.entries) if next_page < first_page.total_pages else 0
+            pending.append(executor.submit(_listing_entries, urljoin(base_url, f"page/{next_page}/"), expected))
+            next_page += 1
+
+    try:
+        for i in range(1, first_page.total_pages + 1):
+            if i == 1:
+                log(f"正在解析 {base_url}")
+                entries = first_page.entries
+            else:
+                page_url = urljoin(base_url, f'page/{i}/')
+                log(f"正在解析 {page_url}")
+                entries = pending.popleft().result()
+                if entries is None:
+                    log(f"第{i}页列表获取失败（已重试{LISTING_RETRIES}次）：{page_url}")
+                    if emit:
+                        emit('listing_failed', url=page_url, category=base_url, page=i)
+                    if incremental:
+                        log(f"增量扫描在第{i}页停止，其后的列表页本次不再扫描")
+                        return
+                    refill()
+                    continue
+            log(f"第{i}页提取到{len(entries)}个条目")
+            # 先做增量检查再补充预取，首页就没有新条目时不会请求后面的列表页
+            if incremental and manifest.all_known(base_url, (url for url, _ in entries)):
+                log(f"第{i}页的条目都已处理过，增量扫描结束")
+                return
+            refill()
+            fresh = [(url, name) for url, name in entries if url not in seen]
+            seen.update(url for url, _ in fresh)
+            if len(fresh) < len(entries):
+                log(f"第{i}页有{len(entries) - len(fresh)}个条目在前面的页出现过，已跳过")
+            if fresh:
+                yield fresh
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def download_image(img_url, save_path, writer=None):
+    # 在下载线程中执行，失败时抛异常，日志由调用线程输出
+    # 传入 writer.WriteBehind 时收完就返回写盘的 Future，线程池会等它写完再完成这张图片
+    if os.path.exists(save_path):
+        return 'skip'
+    if writer is not None:
+        return transport.download_file(img_url, save_path, writer=writer)
+    transport.download_file(img_url, save_path)
+    return 'ok'
+
+
+class Progress:
+    # 结构化进度：统计事件并转发给 callback(dict)，命令行用它输出 JSON lines
+    # hooks 中的 hook(event, fields) 在每个事件上调用，例如条目完成后提交打包
+    def __init__(self, callback=None, hooks=()):
+        self.callback = callback
+        self.hooks = list(hooks)
+        self.counts = Counter()
+        self.bytes = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def __call__(self, event, **fields):
+        with self._lock:
+            if event == 'image':
+                self.counts['image_' + fields['status']] += 1
+                self.bytes += fields.get('bytes', 0) if fields['status'] == 'ok' else 0
+            elif event == 'entry_done':
+                self.counts['entry_' + fields['status']] += 1
+            elif event in ('entry_failed', 'category_failed', 'listing_failed'):
+                self.counts[event] += 1
+        for hook in self.hooks:
+            hook(event, fields)
+        if self.callback:
+            self.callback({'event': event, 'time': round(time.time(), 3), **fields})
+
+    def listing_failures(self):
+        # 打不开的分类首页和列表页数，这些页上的条目本次没有处理
+        return self.counts['category_failed'] + self.counts['listing_failed']
+
+    def summary(self):
+        c = self.counts
+        return {'entries_done': c['entry_done'] + c['entry_skipped'], 'entries_partial': c['entry_partial'],
+                'entries_failed': c['entry_failed'], 'listings_failed': self.listing_failures(),
+                'images_downloaded': c['image_ok'],
+                'images_skipped': c['image_skip'] + c['image_linked'], 'images_failed': c['image_failed'],
+                'bytes': self.bytes, 'elapsed': round(time.time() - self.started, 1)}
+
+
+class Downloader:
+    # 一次运行共用的线程池、清单、重试队列和内容仓库
+    # shared 为 True 时清单不用 WAL，供共享文件系统上多台机器的工作进程同时使用
+    # write_behind 为 True 时图片由后台写盘线程写入(保存目录在 NAS/移动硬盘上时用)，fsync 见 writer.FSYNC_POLICIES
+    def __init__(self, save_dir, log=print, emit=None, workers=IMG_WORKERS, per_host=IMG_PER_HOST,
+                 use_store=False, retry_wait=RETRY_WAIT, shared=False, write_behind=False, fsync=FSYNC_NONE):
+        self.save_dir = save_dir
+        self.log = log
+        self.emit = emit or Progress()
+        self.retry_wait = retry_wait
+        self.pool = DownloadPool(workers, per_host)
+        self.writer = WriteBehind(fsync=fsync) if write_behind else None
+        self.manifest = Manifest.for_dir(save_dir, shared)
+        self.store = ContentStore.for_dir(save_dir, self.manifest) if use_store else None
+        fetch = partial(download_image, writer=self.writer) if self.writer else download_image
+        self.fetch = self.store.wrap(fetch) if self.store else fetch
+        # 条目所属任务的 gate(见 jobs.Job.gate)；任务暂停或取消时它的重试留在清单里，重试时也按它暂停/停止
+        self._gates = {}
+        self.retries = RetryScheduler(self.manifest, self.pool, self.fetch, self._retry_entry, log, self.emit,
+                                      self._held)
+        # 多个任务线程共用一个 Downloader 时，同一时刻只让一个线程处理到期的重试
+        self._poll_lock = threading.Lock()
+        metrics.QUEUE_DEPTH.set_function(lambda: self.pool.in_flight, queue='images')
+        if self.writer:
+            metrics.QUEUE_DEPTH.set_function(lambda: self.writer.pending_bytes, queue='write_bytes')
+        metrics.QUEUE_DEPTH.set_function(self.manifest.failure_count, queue='retries')
+        # 导入旧版本留下的失败列表，和清单里上次没重试完的失败一起排队重试
+        txt_path = os.path.join(save_dir, FAILED_TXT)
+        if os.path.exists(txt_path):
+            imported = self.retries.import_failed_txt(txt_path)
+            if imported:
+                log(f"从 {txt_path} 导入{imported}条失败记录，稍后自动重试")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown()
+        if self.writer:
+            self.writer.close()
+            metrics.QUEUE_DEPTH.remove(queue='write_bytes')
+        self.retries.drain()
+        metrics.QUEUE_DEPTH.remove(queue='images')
+        metrics.QUEUE_DEPTH.remove(queue='retries')
+        self.manifest.close()
+
+    def _run_entry(self, entry_url, gate=None):
+        pipeline.run_entry(entry_url, self.save_dir, self.pool, self.fetch, self.log, self.manifest, self.retries,
+                           self.emit, gate)
+
+    def _held(self, entry_url):
+        gate = self._gates.get(entry_url)
+        return gate is not None and not gate(block=False)
+
+    def _retry_entry(self, entry_url):
+        # 重试可能在别的任务线程里执行，所属任务中途暂停时不阻塞这个线程，剩下的分页/图片留到下次重试
+        gate = self._gates.get(entry_url)
+        self._run_entry(entry_url, gate and partial(gate, block=False))
+
+    def process_entry(self, entry_url, entry_name=None, category_url=None, gate=None):
+        # 分页抓取、图片提取和下载流水线并行，进度记录在保存目录下的 manifest.sqlite3
+        # gate() 暂停时阻塞，返回 False 表示取消；gate(block=False) 不等待，暂停中也返回 False(见 jobs.Job.gate)
+        self.log(f"\n开始处理：{entry_name or entry_url} - {entry_url}")
+        if gate is not None:
+            self._gates[entry_url] = gate
+        try:
+            self._run_entry(entry_url, gate)
+        except Exception as e:
+            metrics.error('entry', e)
+            self.log(f"处理失败：{entry_name or entry_url}，原因：{e}")
+            self.emit('entry_failed', url=entry_url, error=str(e))
+            self.retries.record(PAGE, entry_url, entry_url=entry_url, title=entry_name, page=1, error=e)
+        # 中途取消的条目不记为已处理，下次增量扫描还会遇到它
+        if category_url and (gate is None or gate()):
+            self.manifest.remember_entry(category_url, entry_url)
+        # 到期的重试在处理下一个条目前提交，图片重试与后续条目的下载并行
+        if self._poll_lock.acquire(blocking=False):
+            try:
+                self.retries.poll()
+            finally:
+                self._poll_lock.release()
+        limits = transport.rate_limit.describe(throttled_only=True)
+        if limits:
+            self.log(f"当前限流：{limits}")
+
+    def crawl_category(self, base_url, incremental=False, gate=None):
+        self.log(f"开始解析分类首页：{base_url}")
+        html = get_html(base_url)
+        if not html:
+            self.log("无法获取首页HTML，请检查网络或URL。")
+            self.emit('category_failed', url=base_url)
+            return
+        first_page = extract_page(html)
+        self.log(f"发现分类总页数：{first_page.total_pages}")
+        # 每解析完一页列表就下载这一页的条目，条目内图片并发下载
+        count = 0
+        for entries in iter_entries(base_url, first_page, self.log, self.manifest, incremental,
+                                    emit=self.emit):
+            for entry_url, entry_name in entries:
+                if gate is not None and not gate():
+                    self.log(f"任务已取消：{base_url}，已处理{count}个条目")
+                    return
+                self.process_entry(entry_url, entry_name, base_url, gate)
+                count += 1
+        self.log(f"总共处理{count}个条目")
+        self.emit('category', url=base_url, pages=first_page.total_pages, entries=count)
+
+    def run(self, urls, incremental=False, gate=None):
+        # 条目页地址直接下载，其余地址按分类首页抓取
+        for url in urls:
+            if is_entry_url(url):
+                self.process_entry(url, gate=gate)
+            else:
+                self.crawl_category(url, incremental, gate)
+
+    def finish(self):
+        # 等待后台重试结束，剩余失败写入 download_failed.txt，返回仍未成功的条数
+        deadline = time.time() + self.retry_wait
+        while self.retries.pending() and time.time() < deadline:
+            self.retries.poll(timeout=1)
+        self.log(f"自动重试成功{self.retries.recovered}项，放弃{self.retries.given_up}项")
+        if self.store:
+            self.log("去重报告：\n" + self.store.report())
+        txt_path = os.path.join(self.save_dir, FAILED_TXT)
+        remaining = self.retries.write_failed_txt(txt_path)
+        if remaining:
+            self.log(f"有{remaining}项下载未成功，详情见 {txt_path}")
+        return remaining
+
+
+@contextmanager
+def session(save_dir, log, progress=None, use_cache=True, package=False, remove_loose=False, cache_dir=PAGE_CACHE_DIR,
+            shared=False, hooks=()):
+    # 一次运行的进度、页面缓存和打包进程池，退出时依次关闭并输出本次运行的指标摘要
+    # hooks 为额外的进度 hook(event, fields)，jobs.JobScheduler 用它把事件归到各任务
+    packager = None
+    if package:
+        # 打包用到的 zipfile/进程池只在需要时导入
+        from package import Packager
+        packager = Packager(save_dir, log, remove_loose=remove_loose, shared=shared)
+    emit = Progress(progress, [metrics.progress_hook, *hooks] + ([packager.hook] if packager else []))
+    started = metrics.snapshot()
+    # 页面缓存：再次运行时列表页和条目页大多只需要 304 校验
+    cache = PageCache(os.path.join(save_dir, cache_dir)) if use_cache else None
+    transport.set_page_cache(cache)
+    try:
+        yield emit
+    finally:
+        transport.set_page_cache(None)
+        if cache:
+            cache.close()
+        if packager:
+            packager.close()
+            log(f"打包CBZ {packager.packed}个，失败{packager.failed}个")
+        log(metrics.summary(started))
+
+
+def run(urls, save_dir, log=print, progress=None, workers=IMG_WORKERS, per_host=IMG_PER_HOST, backend='threads',
+        use_cache=True, incremental=False, use_store=False, retry_wait=RETRY_WAIT, package=False,
+        remove_loose=False, write_behind=False, fsync=FSYNC_NONE):
+    # 同步执行一批地址；progress(dict) 接收进度事件，最后收到 summary 事件
+    # package 为 True 时条目完成后在进程池中打包成 CBZ，remove_loose 为 True 时打包后删除散图
+    # write_behind 为 True 时图片交给后台写盘线程写入(只对 threads 引擎有效)
+    # 返回仍未成功的失败条数(asyncio 引擎不做自动重试，返回未完成的条目数)，打不开的分类首页和列表页也计入
+    with session(save_dir, log, progress, use_cache, package, remove_loose) as emit:
+        if backend == 'asyncio':
+            # aiohttp 导入很慢，只有选了 asyncio 引擎才加载
+            import aengine
+            aengine.run_urls(urls, save_dir, log, incremental, use_store, emit)
+            remaining = emit.counts['entry_partial'] + emit.counts['entry_failed']
+        else:
+            with Downloader(save_dir, log, emit, workers, per_host, use_store, retry_wait, False, write_behind,
+                            fsync) as downloader:
+                downloader.run(urls, incremental)
+                remaining = downloader.finish()
+        remaining += emit.listing_failures()
+    emit('summary', remaining=remaining, **emit.summary())
+    return remaining
+
+
+def enqueue(urls, save_dir, log=print, use_cache=True, incremental=False):
+    # 协调者：只抓分类列表页，把条目地址写入保存目录下的工作队列，由 work() 的工作进程下载
+    # 返回新加入队列的条目数
+    queue = WorkQueue.for_dir(save_dir)
+    manifest = Manifest.for_dir(save_dir, shared=True)
+    cache = PageCache(os.path.join(save_dir, PAGE_CACHE_DIR)) if use_cache else None
+    transport.set_page_cache(cache)
+    added = 0
+    try:
+        for url in urls:
+            if is_entry_url(url):
+                added += queue.push([(url, None)])
+                continue
+            log(f"开始解析分类首页：{url}")
+            html = get_html(url)
+            if not html:
+                log(f"无法获取分类首页HTML：{url}")
+                continue
+            first_page = extract_page(html)
+            count = 0
+            # 每页解析完立即入队，工作进程不必等整个分类扫描结束
+            for entries in iter_entries(url, first_page, log, manifest, incremental):
+                added += queue.push(entries, url)
+                count += len(entries)
+            log(f"{url} 共{count}个条目加入队列")
+        log(f"队列状态：{queue.counts()}")
+    finally:
+        transport.set_page_cache(None)
+        if cache:
+            cache.close()
+        manifest.close()
+        queue.close()
+    return added
+
+
+def work(save_dir, log=print, progress=None, workers=IMG_WORKERS, per_host=IMG_PER_HOST, use_cache=True,
+         use_store=False, retry_wait=RETRY_WAIT, package=False, remove_loose=False, wait=False, write_behind=False,
+         fsync=FSYNC_NONE):
+    # 工作进程：按租约从保存目录下的工作队列领取条目下载，队列空了就结束；wait 为 True 时一直等新条目
+    # 别的工作进程还持有租约时继续等待，对方死掉后租约过期，剩下的条目由这里接手
+    # 页面缓存每台机器单独一份，清单不用 WAL，多台机器可以共享同一个保存目录
+    owner = worker_id()
+    queue = WorkQueue.for_dir(save_dir)
+    cache_dir = f'{PAGE_CACHE_DIR}-{socket.gethostname()}'
+    log(f"工作进程 {owner} 启动，队列：{queue.path}")
+    metrics.QUEUE_DEPTH.set_function(lambda: queue.counts().get(QUEUED, 0), queue='entries')
+    try:
+        with session(save_dir, log, progress, use_cache, package, remove_loose, cache_dir, shared=True) as emit:
+            with Downloader(save_dir, log, emit, workers, per_host, use_store, retry_wait, True, write_behind,
+                            fsync) as downloader, \
+                    queue.heartbeat(owner):
+                while True:
+                    job = queue.claim(owner)
+                    if job is None:
+                        if not wait and not queue.counts().get(LEASED):
+                            break
+                        downloader.retries.poll(timeout=QUEUE_POLL)
+                        continue
+                    downloader.process_entry(job['url'], job['title'], job['category_url'])
+                    queue.complete(job['url'], owner)
+                remaining = downloader.finish()
+    finally:
+        metrics.QUEUE_DEPTH.remove(queue='entries')
+        queue.close()
+    emit('summary', remaining=remaining, **emit.summary())
+    return remaining
@@ -0,0 +1,177 @@
+# 177pica 页面解析：分类列表页、漫画条目页、图片地址补全
+# 每个页面只用 lxml 解析一次，标题/分页/图片/列表条目都从同一棵树上用预编译的 XPath 取出
+import functools
+import os
+import re
+from collections import namedtuple
+from urllib.parse import urlparse
+from metrics import PARSE_SECONDS, timed
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+_XPATHS = {
+    'entry_title': f"(//*[{_has_class('entry-title')}])[1]",
+    'head_title': "(//head/title)[1]",
+    'page_link_texts': f"(//div[{_has_class('page-links')}])[1]//a",
+    'has_page_links': f"boolean(//div[{_has_class('page-links')}])",
+    'lazy_imgs': "//div[@class='single-content']//img/@data-lazy-src",
+    'src_imgs': "//div[@class='single-content']//img/@src",
+    'grid_links': f"//h2[{_has_class('grid-title')}]/descendant::a[1][@href]",
+    'page_number_hrefs': f"//a[{_has_class('page-numbers')}]/@href",
+    'all_hrefs': "//a/@href",
+}
+
+
+@functools.cache
+def _xpath(name):
+    # lxml 在第一次解析页面时才导入并编译 XPath，只看 --help 或刚打开窗口时不付这份启动时间
+    from lxml import etree
+    return etree.XPath(_XPATHS[name])
+
+
+_LISTING_PAGE = re.compile(r'/page/(\d+)/')
+# 条目页地址形如 /html/2025/05/6870528.html，分页在后面加 /N
+_ENTRY_PATH = re.compile(r'\.html(?:/\d+)?/?$')
+# 分页数的合理上限：更大的数字是文章 ID、年份之类，不会是分页
+MAX_PAGES = 500
+
+PageInfo = namedtuple('PageInfo', 'title end_page image_urls entries total_pages')
+
+
+def sanitize_filename(name):
+    return re.sub(r'[\\/:*?"<>|]', '_', name)
+
+
+def parse_tree(html):
+    # 空页面或无法解析时返回 None
+    if not html:
+        return None
+    from lxml import etree
+    try:
+        return etree.HTML(html)
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def _text(el):
+    # 与 BeautifulSoup 的 get_text(strip=True) 一致：各段文本去空白后拼接
+    return ''.join(s.strip() for s in el.itertext())
+
+
+def entry_title(tree, default="UnknownEntry", use_head_title=False):
+    if tree is None:
+        return default
+    for el in _xpath('entry_title')(tree):
+        text = _text(el)
+        if text:
+            return sanitize_filename(text)
+    if use_head_title:
+        for el in _xpath('head_title')(tree):
+            text = _text(el)
+            if text:
+                return sanitize_filename(text)
+    return default
+
+
+def _subpage_numbers(tree, entry_url=None):
+    # 只认指向本条目分页的链接：路径是 条目地址/N；不知道条目地址时要求形如 xxx.html/N
+    base = urlparse(entry_url).path.rstrip('/') if entry_url else None
+    for href in _xpath('all_hrefs')(tree):
+        head, _, tail = urlparse(str(href)).path.rstrip('/').rpartition('/')
+        if tail.isdigit() and (head == base if base else head.endswith('.html')):
+            yield int(tail)
+
+
+def entry_end_page(tree, entry_url=None):
+    # 优先取分页栏的最大数字；没有分页栏时取指向本条目分页的链接里的最大页码
+    # 都找不到时返回 None，由 pagecount.resolve 发少量请求探测，不再从整页 HTML 里找最大数字
+    if tree is None:
+        return None
+    if _xpath('has_page_links')(tree):
+        page_numbers = [int(t) for t in (_text(a) for a in _xpath('page_link_texts')(tree)) if t.isdigit()]
+        if not page_numbers:
+            return 1
+        page_numbers = [n for n in page_numbers if n <= MAX_PAGES]
+        return max(page_numbers) if page_numbers else None
+    page_numbers = [n for n in _subpage_numbers(tree, entry_url) if n <= MAX_PAGES]
+    return max(page_numbers) if page_numbers else None
+
+
+def image_urls(tree):
+    # 优先 data-lazy-src，再用 src
+    if tree is None:
+        return []
+    return [str(u) for u in (_xpath('lazy_imgs')(tree) or _xpath('src_imgs')(tree))]
+
+
+def listing_entries(tree):
+    if tree is None:
+        return []
+    return [(a.get('href'), _text(a)) for a in _xpath('grid_links')(tree)]
+
+
+def listing_total_pages(tree):
+    max_page = 1
+    if tree is None:
+        return max_page
+    for href in _xpath('page_number_hrefs')(tree):
+        m = _LISTING_PAGE.search(href)
+        if m:
+            max_page = max(max_page, int(m.group(1)))
+    return max_page
+
+
+@timed(PARSE_SECONDS, what='page')
+def extract_page(html, default_title="UnknownEntry", use_head_title=False):
+    # 一次解析，返回该页面上所有可提取的信息
+    tree = parse_tree(html)
+    return PageInfo(entry_title(tree, default_title, use_head_title), entry_end_page(tree),
+                    image_urls(tree), listing_entries(tree), listing_total_pages(tree))
+
+
+@timed(PARSE_SECONDS, what='listing')
+def get_total_pages(html):
+    return listing_total_pages(parse_tree(html))
+
+
+@timed(PARSE_SECONDS, what='listing')
+def get_entries_from_page(html):
+    return listing_entries(parse_tree(html))
+
+
+@timed(PARSE_SECONDS, what='entry')
+def parse_entry_page(html, default_title="UnknownEntry", use_head_title=False, entry_url=None):
+    # 返回 (标题, 分页数, 第一页图片)；分页数为 None 表示页面上没有可信的分页信息
+    tree = parse_tree(html)
+    return (entry_title(tree, default_title, use_head_title), entry_end_page(tree, entry_url),
+            image_urls(tree))
+
+
+@timed(PARSE_SECONDS, what='images')
+def get_image_urls_from_page(html):
+    return image_urls(parse_tree(html))
+
+
+def is_entry_url(url):
+    # 条目页返回 True，其余(分类首页、标签页等)按分类处理
+    return bool(_ENTRY_PATH.search(urlparse(url).path))
+
+
+def complete_img_url(img_url):
+    if img_url.startswith('//'):
+        img_url = 'http:' + img_url
+    elif img_url.startswith('/'):
+        img_url = 'http://www.177pica.com' + img_url
+    elif not img_url.startswith('http'):
+        img_url = 'http://' + img_url
+    return img_url
+
+
+def image_save_path(save_dir, idx, img_url):
+    ext = os.path.splitext(urlparse(img_url).path)[-1]
+    if not ext or len(ext) > 5:
+        ext = ".jpg"
+    return os.path.join(save_dir, f"{idx:03d}{ext}")
@@ -0,0 +1,77 @@
+# 界面日志：任何线程都只往线程安全的队列里放消息，界面线程用 root.after 定时批量取出写入文本框
+# 文本框只保留最近 MAX_LINES 行，长时间运行时内存不会无限增长
+import queue
+import tkinter as tk
+
+# 刷新间隔(毫秒) / 每次刷新最多写入的行数 / 文本框保留的行数
+FLUSH_INTERVAL_MS = 100
+MAX_BATCH = 2000
+MAX_LINES = 5000
+
+_CLEAR = object()
+
+
+class LogPane:
+    def __init__(self, widget, echo=False, max_lines=MAX_LINES, interval=FLUSH_INTERVAL_MS):
+        # echo 为 True 时同时打印到控制台
+        self.widget = widget
+        self.echo = echo
+        self.max_lines = max_lines
+        self.interval = interval
+        self.queue = queue.SimpleQueue()
+        widget.after(interval, self._flush)
+
+    def write(self, msg):
+        if self.echo:
+            print(msg)
+        self.queue.put(msg)
+
+    __call__ = write
+
+    def clear(self):
+        self.queue.put(_CLEAR)
+
+    def call(self, fn, *args):
+        # 让 fn(*args) 在界面线程中执行，例如下载线程结束时弹出提示框
+        self.queue.put((fn, args))
+
+    def _flush(self):
+        # 队列里的回调抛异常时交给 Tk 报告，但下一次刷新照样安排，日志框不会就此停止更新
+        lines = []
+        try:
+            while len(lines) < MAX_BATCH:
+                item = self.queue.get_nowait()
+                if item is _CLEAR:
+                    lines = []
+                    self._clear_widget()
+                elif isinstance(item, tuple):
+                    self._insert(lines)
+                    lines = []
+                    item[0](*item[1])
+                else:
+                    lines.append(item)
+        except queue.Empty:
+            pass
+        finally:
+            try:
+                self._insert(lines)
+            finally:
+                self.widget.after(self.interval, self._flush)
+
+    def _clear_widget(self):
+        self.widget.configure(state='normal')
+        self.widget.delete('1.0', tk.END)
+        self.widget.configure(state='disabled')
+
+    def _insert(self, lines):
+        if not lines:
+            return
+        w = self.widget
+        w.configure(state='normal')
+        w.insert(tk.END, '\n'.join(lines) + '\n')
+        # 每行都以换行结尾，最后一个字符之后是一个空行，日志行数为 end-1c 的行号减一
+        count = int(w.index('end-1c').split('.')[0]) - 1
+        if count > self.max_lines:
+            w.delete('1.0', f'{count - self.max_lines + 1}.0')
+        w.see(tk.END)
+        w.configure(state='disabled')
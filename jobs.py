@@ -0,0 +1,253 @@
+# 批量任务调度：每个地址(条目页或分类首页)是一个任务，按优先级同时运行 max_jobs 个
+# 所有任务共用一个 core.Downloader，也就共用同一个图片下载线程池(全局并发预算)；每个任务可暂停、继续、取消
+# 限速时各任务按带宽权重分配 transport.bandwidth_limit 的总速率
+import heapq
+import itertools
+import threading
+from contextlib import ExitStack
+import bandwidth
+from core import Downloader, session, IMG_WORKERS, IMG_PER_HOST
+from transport import bandwidth_limit
+
+# 同时运行的任务数
+MAX_JOBS = 3
+
+# 任务状态
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+PARTIAL = 'partial'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, PARTIAL, FAILED, CANCELLED)
+
+
+class Job:
+    def __init__(self, job_id, url, priority=0, weight=1):
+        self.id = job_id
+        self.url = url
+        self.priority = priority
+        # 带宽权重：限速时按权重比例分配总速率
+        self.weight = weight
+        self.state = QUEUED
+        self.error = None
+        # 进度：条目完成/未完成数、图片成功/失败数、正在处理的条目标题
+        self.entries_done = 0
+        self.entries_partial = 0
+        self.images_ok = 0
+        self.images_failed = 0
+        self.current = ''
+        self._resume = threading.Event()
+        self._resume.set()
+        self._started = False
+        self._cancelled = False
+
+    @property
+    def share(self):
+        # 带宽份额的名字
+        return f'job-{self.id}'
+
+    def gate(self, block=True):
+        # 下载线程提交每张图片、开始每个条目前调用：暂停时阻塞，取消后返回 False
+        # block 为 False 时不等待，暂停中也返回 False；别的任务线程处理这个任务的重试时用
+        if not block:
+            return self._resume.is_set() and not self._cancelled
+        self._resume.wait()
+        return not self._cancelled
+
+    def on_event(self, event, fields):
+        if event == 'entry_start':
+            self.current = fields.get('title') or ''
+        elif event == 'entry_done':
+            if fields['status'] == PARTIAL:
+                self.entries_partial += 1
+            else:
+                self.entries_done += 1
+        elif event == 'entry_failed':
+            self.entries_partial += 1
+        elif event == 'category_failed':
+            self.error = '无法获取分类首页'
+        elif event == 'image':
+            if fields['status'] == 'failed':
+                self.images_failed += 1
+            else:
+                self.images_ok += 1
+
+    def describe(self):
+        text = f"条目 {self.entries_done}"
+        if self.entries_partial:
+            text += f"(未完成{self.entries_partial})"
+        text += f" · 图片 {self.images_ok}"
+        if self.images_failed:
+            text += f"(失败{self.images_failed})"
+        return text
+
+
+class JobScheduler:
+    # 任务线程里的进度事件按线程归到对应任务；on_change(job) 在状态变化时调用(在任务线程中)
+    # 与 core.run 共用 core.session：指标进度、页面缓存和结束时的指标摘要
+    def __init__(self, save_dir, log=print, max_jobs=MAX_JOBS, workers=IMG_WORKERS, per_host=IMG_PER_HOST,
+                 use_store=False, on_change=None, use_cache=True):
+        self.save_dir = save_dir
+        self.log = log
+        self.max_jobs = max_jobs
+        self.on_change = on_change or (lambda job: None)
+        self.jobs = []
+        self._heap = []
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._running = 0
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        # 条目地址 -> 最初处理它的任务
+        self._owners = {}
+        self._stack = ExitStack()
+        self.emit = self._stack.enter_context(session(save_dir, log, use_cache=use_cache, hooks=[self._on_event]))
+        try:
+            self.downloader = Downloader(save_dir, log, self.emit, workers, per_host, use_store)
+        except BaseException:
+            self._stack.close()
+            raise
+
+    def _on_event(self, event, fields):
+        # 重试可能在别的任务线程里执行，条目的事件按条目地址归到最初处理它的任务
+        job = getattr(self._local, 'job', None)
+        entry_url = fields.get('entry') or (fields.get('url') if event.startswith('entry') else None)
+        if entry_url:
+            with self._cond:
+                owner = self._owners.get(entry_url)
+                if event == 'entry_start' and job is not None and (owner is None or owner.state in FINISHED):
+                    self._owners[entry_url] = job
+                else:
+                    job = owner or job
+        if job is not None:
+            job.on_event(event, fields)
+
+    def _push(self, job):
+        # 优先级数字越大越先运行，同优先级按加入顺序
+        heapq.heappush(self._heap, (-job.priority, next(self._seq), job))
+
+    def add(self, url, priority=0, weight=1):
+        # 同一地址还在排队或运行时不重复加入，返回已有的任务
+        with self._cond:
+            for job in self.jobs:
+                if job.url == url and job.state not in FINISHED:
+                    return job
+            job = Job(next(self._ids), url, priority, weight)
+            self.jobs.append(job)
+            self._push(job)
+            self._dispatch()
+        return job
+
+    def set_priority(self, job, priority):
+        # 只影响还在排队的任务的启动顺序；旧的堆元素在出堆时按优先级不符丢弃
+        with self._cond:
+            job.priority = priority
+            if job.state == QUEUED:
+                self._push(job)
+
+    def set_weight(self, job, weight):
+        # 运行中立即生效
+        job.weight = weight
+        if job.state not in FINISHED:
+            bandwidth_limit.set_weight(job.share, weight)
+
+    def pause(self, job):
+        with self._cond:
+            if job.state in (QUEUED, RUNNING):
+                job._resume.clear()
+                job.state = PAUSED
+                self._cond.notify_all()
+        self.on_change(job)
+
+    def resume(self, job):
+        with self._cond:
+            if job.state == PAUSED:
+                job._resume.set()
+                if job._started:
+                    job.state = RUNNING
+                else:
+                    # 排队时被暂停的任务已经出堆，重新排队
+                    job.state = QUEUED
+                    self._push(job)
+                    self._dispatch()
+                self._cond.notify_all()
+        self.on_change(job)
+
+    def cancel(self, job):
+        # 已提交给线程池的图片会下载完，其余的不再提交；条目留在清单里，下次运行可继续
+        with self._cond:
+            if job.state in FINISHED:
+                return
+            job._cancelled = True
+            job._resume.set()
+            if not job._started:
+                job.state = CANCELLED
+            self._cond.notify_all()
+        self.on_change(job)
+
+    def _dispatch(self):
+        # 调用方持有 self._cond
+        while self._running < self.max_jobs and self._heap:
+            neg_priority, _, job = heapq.heappop(self._heap)
+            if job.state != QUEUED or -neg_priority != job.priority:
+                continue
+            job.state = RUNNING
+            job._started = True
+            self._running += 1
+            threading.Thread(target=self._run_job, args=(job,), daemon=True).start()
+
+    def _run_job(self, job):
+        self._local.job = job
+        self.on_change(job)
+        self.log(f"\n===== 开始任务 #{job.id}（优先级{job.priority}）：{job.url} =====")
+        bandwidth_limit.set_weight(job.share, job.weight)
+        try:
+            with bandwidth.share(job.share):
+                self.downloader.run([job.url], gate=job.gate)
+        except Exception as e:
+            job.error = str(e)
+            self.log(f"任务 #{job.id} 失败：{e}")
+        finally:
+            self._local.job = None
+            bandwidth_limit.remove(job.share)
+            with self._cond:
+                if job._cancelled:
+                    job.state = CANCELLED
+                elif job.error and not job.entries_done:
+                    job.state = FAILED
+                elif job.entries_partial or job.images_failed:
+                    job.state = PARTIAL
+                else:
+                    job.state = DONE
+                job.current = ''
+                self._running -= 1
+                self._dispatch()
+                self._cond.notify_all()
+            self.log(f"===== 任务 #{job.id} 结束：{job.describe()} =====")
+            self.on_change(job)
+
+    def _idle(self):
+        return self._running == 0 and not any(job.state in (QUEUED, PAUSED) for job in self.jobs)
+
+    def idle(self):
+        with self._cond:
+            return self._idle()
+
+    def wait(self):
+        # 等所有任务结束(暂停中的任务也要等到被继续或取消)
+        with self._cond:
+            while not self._idle():
+                self._cond.wait()
+
+    def finish(self):
+        # 等后台重试、写失败列表并关闭下载器和页面缓存，返回仍未成功的条数(含打不开的分类首页和列表页)
+        self.wait()
+        try:
+            return self.downloader.finish() + self.emit.listing_failures()
+        finally:
+            try:
+                self.downloader.close()
+            finally:
+                self._stack.close()
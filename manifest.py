@@ -0,0 +1,280 @@
+# 下载清单：用 SQLite 记录条目、分页、图片地址、保存路径、大小和状态
+# 重启时已完成的条目不发任何请求，未完成的条目只补下缺失的图片
+import os
+import sqlite3
+import threading
+import time
+
+MANIFEST_NAME = 'manifest.sqlite3'
+# 多个进程同时写清单时等待锁的时间(秒)
+BUSY_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    title TEXT,
+    save_dir TEXT,
+    end_page INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    entry_url TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (entry_url, page)
+);
+CREATE TABLE IF NOT EXISTS images (
+    entry_url TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    page INTEGER,
+    url TEXT NOT NULL,
+    path TEXT NOT NULL,
+    bytes INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    PRIMARY KEY (entry_url, idx)
+);
+CREATE TABLE IF NOT EXISTS category_entries (
+    category_url TEXT NOT NULL,
+    entry_url TEXT NOT NULL,
+    seen REAL,
+    PRIMARY KEY (category_url, entry_url)
+);
+CREATE TABLE IF NOT EXISTS failures (
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    path TEXT NOT NULL DEFAULT '',
+    entry_url TEXT,
+    title TEXT,
+    page INTEGER,
+    idx INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_try REAL NOT NULL,
+    error TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    PRIMARY KEY (kind, url, path)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_sha256 ON blobs (sha256);
+"""
+
+# 条目/分页/图片状态
+PENDING = 'pending'
+DONE = 'done'
+PARTIAL = 'partial'
+FAILED = 'failed'
+
+
+class Manifest:
+    def __init__(self, path, shared=False):
+        # shared 为 True 时不用 WAL，供共享文件系统上多台机器的工作进程同时使用
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=DELETE' if shared else 'PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    @classmethod
+    def for_dir(cls, save_dir, shared=False):
+        os.makedirs(save_dir, exist_ok=True)
+        return cls(os.path.join(save_dir, MANIFEST_NAME), shared)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            cur = self._db.execute(sql, args)
+            self._db.commit()
+            return cur
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    # ---- 条目 ----
+    def get_entry(self, url):
+        rows = self._query('SELECT * FROM entries WHERE url = ?', (url,))
+        return dict(rows[0]) if rows else None
+
+    def save_entry(self, url, title, save_dir, end_page):
+        self._execute(
+            'INSERT INTO entries (url, title, save_dir, end_page, status, updated) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(url) DO UPDATE SET title = excluded.title, save_dir = excluded.save_dir, '
+            'end_page = excluded.end_page, updated = excluded.updated',
+            (url, title, save_dir, end_page, PENDING, time.time()))
+
+    def set_entry_status(self, url, status):
+        self._execute('UPDATE entries SET status = ?, updated = ? WHERE url = ?', (status, time.time(), url))
+
+    # ---- 分页 ----
+    def record_page(self, entry_url, page, images, ok=True):
+        # images: [(idx, img_url, save_path), ...]；同一位置地址不变时保留已完成状态
+        # 返回该位置原先对应其他图片的旧文件路径，调用方应删除这些过期文件
+        stale = []
+        with self._lock:
+            for idx, img_url, save_path in images:
+                row = self._db.execute('SELECT url, path, status FROM images WHERE entry_url = ? AND idx = ?',
+                                       (entry_url, idx)).fetchone()
+                if row is None:
+                    self._db.execute('INSERT INTO images (entry_url, idx, page, url, path) VALUES (?, ?, ?, ?, ?)',
+                                     (entry_url, idx, page, img_url, save_path))
+                elif (row['url'], row['path']) != (img_url, save_path):
+                    if row['status'] == DONE:
+                        stale.append(row['path'])
+                    self._db.execute('UPDATE images SET page = ?, url = ?, path = ?, bytes = NULL, status = ? '
+                                     'WHERE entry_url = ? AND idx = ?',
+                                     (page, img_url, save_path, PENDING, entry_url, idx))
+            self._db.execute('INSERT OR REPLACE INTO pages (entry_url, page, status) VALUES (?, ?, ?)',
+                             (entry_url, page, DONE if ok else FAILED))
+            self._db.commit()
+        return stale
+
+    def pages_complete(self, entry_url):
+        # 所有分页都已成功解析，续传时不必再抓分页
+        entry = self.get_entry(entry_url)
+        if entry is None or not entry['end_page']:
+            return False
+        rows = self._query('SELECT COUNT(*) FROM pages WHERE entry_url = ? AND page <= ? AND status = ?',
+                           (entry_url, entry['end_page'], DONE))
+        return rows[0][0] >= entry['end_page']
+
+    def page_status(self, entry_url, page):
+        rows = self._query('SELECT status FROM pages WHERE entry_url = ? AND page = ?', (entry_url, page))
+        return rows[0][0] if rows else None
+
+    def trim_images(self, entry_url, count):
+        # 重新抓取后图片变少时，删掉多余的旧记录
+        self._execute('DELETE FROM images WHERE entry_url = ? AND idx > ?', (entry_url, count))
+
+    # ---- 图片 ----
+    def images(self, entry_url, status=None):
+        if status is None:
+            rows = self._query('SELECT * FROM images WHERE entry_url = ? ORDER BY idx', (entry_url,))
+        else:
+            rows = self._query('SELECT * FROM images WHERE entry_url = ? AND status = ? ORDER BY idx',
+                               (entry_url, status))
+        return [dict(r) for r in rows]
+
+    def image_status(self, entry_url, idx):
+        rows = self._query('SELECT status FROM images WHERE entry_url = ? AND idx = ?', (entry_url, idx))
+        return rows[0][0] if rows else None
+
+    def image_by_path(self, path):
+        rows = self._query('SELECT * FROM images WHERE path = ?', (path,))
+        return dict(rows[0]) if rows else None
+
+    def mark_image(self, entry_url, idx, status, size=None):
+        self._execute('UPDATE images SET status = ?, bytes = COALESCE(?, bytes) WHERE entry_url = ? AND idx = ?',
+                      (status, size, entry_url, idx))
+
+    def image_count(self, entry_url):
+        rows = self._query('SELECT COUNT(*) FROM images WHERE entry_url = ?', (entry_url,))
+        return rows[0][0]
+
+    def missing_count(self, entry_url):
+        rows = self._query('SELECT COUNT(*) FROM images WHERE entry_url = ? AND status != ?', (entry_url, DONE))
+        return rows[0][0]
+
+    def finish_entry(self, entry_url):
+        # 分页齐全且所有图片都已完成才算完成
+        done = self.pages_complete(entry_url) and self.image_count(entry_url) and not self.missing_count(entry_url)
+        self.set_entry_status(entry_url, DONE if done else PARTIAL)
+        return bool(done)
+
+    # ---- 分类增量 ----
+    def known_entries(self, category_url, entry_urls):
+        # 返回 entry_urls 中已经在该分类下处理过的条目
+        entry_urls = list(entry_urls)
+        with self._lock:
+            return {row[0] for row in self._db.execute(
+                'SELECT entry_url FROM category_entries WHERE category_url = ? AND entry_url IN (%s)'
+                % ','.join('?' * len(entry_urls)), [category_url, *entry_urls])}
+
+    def all_known(self, category_url, entry_urls):
+        # 列表页整页都是处理过的条目；空页面(可能是请求失败)不算
+        entry_urls = set(entry_urls)
+        return bool(entry_urls) and len(self.known_entries(category_url, entry_urls)) == len(entry_urls)
+
+    def remember_entry(self, category_url, entry_url):
+        self._execute('INSERT OR REPLACE INTO category_entries (category_url, entry_url, seen) VALUES (?, ?, ?)',
+                      (category_url, entry_url, time.time()))
+
+    # ---- 内容寻址仓库 ----
+    def blob_for_url(self, url):
+        rows = self._query('SELECT sha256, size FROM blobs WHERE url = ?', (url,))
+        return dict(rows[0]) if rows else None
+
+    def record_blob(self, url, sha256, size):
+        self._execute('INSERT OR REPLACE INTO blobs (url, sha256, size) VALUES (?, ?, ?)', (url, sha256, size))
+
+    def images_without_blob(self):
+        rows = self._query('SELECT i.* FROM images i LEFT JOIN blobs b ON b.url = i.url '
+                           'WHERE i.status = ? AND b.url IS NULL', (DONE,))
+        return [dict(r) for r in rows]
+
+    def dedupe_stats(self, top=10):
+        # 已完成且已存入仓库的图片按内容哈希汇总
+        with self._lock:
+            images, logical, unique = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(b.size), 0), COUNT(DISTINCT b.sha256) '
+                'FROM images i JOIN blobs b ON b.url = i.url WHERE i.status = ?', (DONE,)).fetchone()
+            physical = self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(b.size) AS size FROM images i '
+                'JOIN blobs b ON b.url = i.url WHERE i.status = ? GROUP BY b.sha256)', (DONE,)).fetchone()[0]
+            dups = self._db.execute(
+                'SELECT b.sha256, COUNT(*) AS count, COUNT(DISTINCT i.entry_url) AS entries, MAX(b.size) AS size, '
+                'MIN(i.path) AS example FROM images i JOIN blobs b ON b.url = i.url WHERE i.status = ? '
+                'GROUP BY b.sha256 HAVING COUNT(*) > 1 ORDER BY count DESC, size DESC LIMIT ?',
+                (DONE, top)).fetchall()
+        return {'images': images, 'logical_bytes': logical, 'unique': unique, 'physical_bytes': physical,
+                'top': [dict(r) for r in dups]}
+
+    # ---- 失败重试 ----
+    def add_failure(self, kind, url, path='', entry_url=None, title=None, page=None, idx=None,
+                    error=None, next_try=0.0):
+        # 已在队列中的失败只更新原因，保留重试次数和计划时间；已放弃的失败重新开始计数
+        self._execute(
+            'INSERT INTO failures (kind, url, path, entry_url, title, page, idx, next_try, error) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(kind, url, path) DO UPDATE SET '
+            'entry_url = COALESCE(excluded.entry_url, entry_url), title = COALESCE(excluded.title, title), '
+            'page = COALESCE(excluded.page, page), idx = COALESCE(excluded.idx, idx), error = excluded.error, '
+            'attempts = CASE WHEN status = ? THEN attempts ELSE 0 END, '
+            'next_try = CASE WHEN status = ? THEN next_try ELSE excluded.next_try END, status = ?',
+            (kind, url, path or '', entry_url, title, page, idx, next_try, error, PENDING, PENDING, PENDING))
+
+    def due_failures(self, now):
+        rows = self._query('SELECT * FROM failures WHERE status = ? AND next_try <= ? ORDER BY next_try',
+                           (PENDING, now))
+        return [dict(r) for r in rows]
+
+    def next_failure_time(self):
+        # 最近一次计划重试的时间，没有待重试的失败时返回 None
+        return self._query('SELECT MIN(next_try) FROM failures WHERE status = ?', (PENDING,))[0][0]
+
+    def reschedule_failure(self, kind, url, path, attempts, next_try, error, status=PENDING):
+        self._execute('UPDATE failures SET attempts = ?, next_try = ?, error = ?, status = ? '
+                      'WHERE kind = ? AND url = ? AND path = ?',
+                      (attempts, next_try, error, status, kind, url, path or ''))
+
+    def remove_failure(self, kind, url, path=''):
+        self._execute('DELETE FROM failures WHERE kind = ? AND url = ? AND path = ?', (kind, url, path or ''))
+
+    def failure_count(self, status=PENDING):
+        return self._query('SELECT COUNT(*) FROM failures WHERE status = ?', (status,))[0][0]
+
+    def failures(self, status=None):
+        if status is None:
+            rows = self._query('SELECT * FROM failures ORDER BY entry_url, page, idx')
+        else:
+            rows = self._query('SELECT * FROM failures WHERE status = ? ORDER BY entry_url, page, idx', (status,))
+        return [dict(r) for r in rows]
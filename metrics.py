@@ -0,0 +1,320 @@
+# 运行指标：页面请求、解析、图片传输、写盘、队列深度和错误类型的计数器/直方图，
+# 可写成 Prometheus 文本格式文件(node_exporter textfile)或开本地 HTTP 端点供抓取，运行结束时输出摘要
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'pica_'
+# 请求/下载耗时的直方图分桶(秒)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 解析耗时分桶(秒)
+PARSE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+# 指标文件的刷新间隔(秒)
+TEXTFILE_INTERVAL = 15
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_str(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = PREFIX + name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(n, '') for n in self.labels), 0)
+
+    def items(self):
+        # (标签值元组, 计数) 的副本，可以在其他线程继续计数时遍历
+        with self._lock:
+            return list(self._values.items())
+
+    def samples(self):
+        for key, value in self.items():
+            yield self.name + _label_str(self.labels, key), value
+
+
+class Gauge:
+    # 队列深度之类的瞬时值：set_function 注册的函数在抓取时才调用
+    kind = 'gauge'
+
+    def __init__(self, name, doc, labels=()):
+        self.name = PREFIX + name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._functions = {}
+        self._lock = threading.Lock()
+
+    def set_function(self, fn, **labels):
+        with self._lock:
+            self._functions[tuple(labels.get(n, '') for n in self.labels)] = fn
+
+    def remove(self, **labels):
+        with self._lock:
+            self._functions.pop(tuple(labels.get(n, '') for n in self.labels), None)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._functions.items())
+        for key, fn in items:
+            try:
+                value = fn()
+            except Exception:
+                # 数据源已经关闭(例如清单已关闭)，这次抓取跳过
+                continue
+            yield self.name + _label_str(self.labels, key), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # 标签 -> [各分桶计数..., +Inf 计数, 总和]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 2)
+            data[i] += 1
+            data[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def keys(self):
+        # 已有数据的标签值元组
+        with self._lock:
+            return list(self._values)
+
+    def stats(self, **labels):
+        # 返回 (次数, 总和, 分桶计数)，没有数据时次数为 0
+        with self._lock:
+            data = list(self._values.get(tuple(labels.get(n, '') for n in self.labels), ()))
+        if not data:
+            return 0, 0.0, [0] * (len(self.buckets) + 1)
+        return sum(data[:-1]), data[-1], data[:-1]
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(data)) for key, data in self._values.items()]
+        names = self.labels + ('le',)
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), data[:-1]):
+                cumulative += count
+                yield self.name + '_bucket' + _label_str(names, key + (bound,)), cumulative
+            yield self.name + '_count' + _label_str(self.labels, key), cumulative
+            yield self.name + '_sum' + _label_str(self.labels, key), round(data[-1], 6)
+
+
+def quantile(buckets, counts, q):
+    # 按分桶估算分位数，返回所在分桶的上界；落在 +Inf 桶时返回最大的有限上界
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank, cumulative = q * total, 0
+    for bound, count in zip(buckets, counts):
+        cumulative += count
+        if cumulative >= rank:
+            return bound
+    return buckets[-1]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Prometheus 文本格式
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.doc}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name} {value}' for name, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# ---- 指标定义 ----
+REQUESTS = REGISTRY.register(Counter('requests_total', 'HTTP 请求数，按类型(page/image)和状态码', ('kind', 'status')))
+REQUEST_SECONDS = REGISTRY.register(Histogram('request_seconds', '单次请求收到响应头的耗时', ('kind',)))
+PAGE_SECONDS = REGISTRY.register(Histogram('page_fetch_seconds', '获取一个 HTML 页面的总耗时(含缓存校验和重试)'))
+IMAGE_SECONDS = REGISTRY.register(Histogram('image_download_seconds', '下载一张图片的总耗时(含传输和写盘)'))
+BYTES = REGISTRY.register(Counter('bytes_total', '下载的字节数', ('kind',)))
+PARSE_SECONDS = REGISTRY.register(Histogram('parse_seconds', 'HTML 解析耗时', ('what',), PARSE_BUCKETS))
+DISK_SECONDS = REGISTRY.register(Counter('disk_write_seconds_total', '写图片文件(写入和改名)累计耗时'))
+PAGES = REGISTRY.register(Counter('pages_total', '获取的 HTML 页面数，按结果(ok/cached/empty)', ('result',)))
+IMAGES = REGISTRY.register(Counter('images_total', '图片数，按结果(ok/skip/linked/failed)', ('status',)))
+ENTRIES = REGISTRY.register(Counter('entries_total', '条目数，按结果(done/partial/skipped/failed)', ('status',)))
+ERRORS = REGISTRY.register(Counter('errors_total', '错误数，按阶段和异常类型', ('stage', 'type')))
+QUEUE_DEPTH = REGISTRY.register(Gauge('queue_depth', '各队列当前长度', ('queue',)))
+
+
+def error(stage, err):
+    # 按异常类名计数；err 是文字说明时归为 Error，避免标签值无限增多
+    ERRORS.inc(stage=stage, type=type(err).__name__ if isinstance(err, BaseException) else 'Error')
+
+
+def timed(histogram, **labels):
+    # 装饰器：记录函数耗时
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def progress_hook(event, fields):
+    # 接在 core.Progress 上，把条目/图片结果计入指标
+    if event == 'image':
+        IMAGES.inc(status=fields['status'])
+    elif event == 'entry_done':
+        ENTRIES.inc(status=fields['status'])
+    elif event == 'entry_failed':
+        ENTRIES.inc(status='failed')
+
+
+def write_textfile(path):
+    # 先写临时文件再改名，抓取方不会读到写了一半的文件
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_path, path)
+
+
+def _make_server(host, port):
+    # http.server 只在开了指标端口时才导入
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+class Exporter:
+    # textfile 不为空时每 interval 秒刷新一次指标文件；port 不为空时在 host:port 提供 /metrics
+    def __init__(self, textfile=None, port=None, host='127.0.0.1', interval=TEXTFILE_INTERVAL):
+        self.textfile = textfile
+        self.interval = interval
+        self._stop = threading.Event()
+        self._server = None
+        if port is not None:
+            self._server = _make_server(host, port)
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self._thread = None
+        if textfile:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            write_textfile(self.textfile)
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            write_textfile(self.textfile)
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def snapshot():
+    # 记下当前的累计值，summary(since=...) 只统计这之后的部分(界面里多次运行时各算各的)
+    return {
+        'time': time.time(),
+        'pages': PAGE_SECONDS.stats(),
+        'images': IMAGE_SECONDS.stats(),
+        'parse': {key[0]: PARSE_SECONDS.stats(what=key[0]) for key in PARSE_SECONDS.keys()},
+        'bytes': BYTES.value(kind='image') + BYTES.value(kind='page'),
+        'disk': DISK_SECONDS.value(),
+        'errors': dict(ERRORS.items()),
+    }
+
+
+def _delta(now, before):
+    count = now[0] - before[0]
+    counts = [a - b for a, b in zip(now[2], before[2])]
+    return count, now[1] - before[1], counts
+
+
+def summary(since):
+    # 运行结束时的文字摘要：各阶段次数、速率、平均和 p95 耗时、错误类型
+    elapsed = max(time.time() - since['time'], 1e-6)
+    now = snapshot()
+    lines = [f"运行指标：用时{elapsed:.1f}秒"]
+    count, total, counts = _delta(now['pages'], since['pages'])
+    if count:
+        lines.append(f"  页面 {count} 个（{count / elapsed:.1f}/秒），平均 {total / count:.3f} 秒，"
+                     f"p95 ≤{quantile(PAGE_SECONDS.buckets, counts, 0.95)} 秒")
+    count, total, counts = _delta(now['images'], since['images'])
+    size = now['bytes'] - since['bytes']
+    if count:
+        lines.append(f"  图片 {count} 张（{count / elapsed:.1f}/秒），平均 {total / count:.3f} 秒，"
+                     f"p95 ≤{quantile(IMAGE_SECONDS.buckets, counts, 0.95)} 秒")
+    if size:
+        lines.append(f"  下载 {size / 1024 / 1024:.1f}MB（{size / 1024 / 1024 / elapsed:.2f}MB/秒）")
+    for key, totals in now['parse'].items():
+        count, total, _ = _delta(totals, since['parse'].get(key, (0, 0.0, [0] * len(totals[2]))))
+        if count:
+            lines.append(f"  解析({key}) {count} 次，平均 {total / count * 1000:.1f} 毫秒，合计 {total:.2f} 秒")
+    disk = now['disk'] - since['disk']
+    if disk:
+        lines.append(f"  写盘合计 {disk:.2f} 秒")
+    errors = {key: value - since['errors'].get(key, 0) for key, value in now['errors'].items()}
+    errors = {key: value for key, value in errors.items() if value}
+    if errors:
+        lines.append("  错误：" + '，'.join(f"{stage}/{kind} {value}" for (stage, kind), value in sorted(errors.items())))
+    return '\n'.join(lines)
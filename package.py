@@ -0,0 +1,84 @@
+# CBZ 打包：条目全部图片下载完成后，按页码顺序把图片不压缩地(ZIP_STORED)写入 <标题>/<标题>.cbz
+# 打包在进程池中进行，不占用下载线程；可选打包后删除散图
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+from manifest import Manifest, DONE
+from transport import PART_SUFFIX
+
+# 打包进程数
+PACK_WORKERS = 2
+
+
+def cbz_path_for(entry):
+    # 与 images 目录同级：<保存目录>/<标题>/<标题>.cbz
+    return os.path.join(os.path.dirname(entry['save_dir']), entry['title'] + '.cbz')
+
+
+def build_cbz(cbz_path, title, paths, remove_loose=False):
+    # 在打包进程中执行：先写 .part，完整后原子改名；返回 (cbz_path, 图片数, 文件大小)
+    part_path = cbz_path + PART_SUFFIX
+    with zipfile.ZipFile(part_path, 'w', zipfile.ZIP_STORED) as zf:
+        for path in paths:
+            zf.write(path, os.path.basename(path))
+        zf.writestr('ComicInfo.xml',
+                    '<?xml version="1.0" encoding="utf-8"?>\n<ComicInfo>'
+                    f'<Title>{escape(title)}</Title><PageCount>{len(paths)}</PageCount></ComicInfo>\n')
+    os.replace(part_path, cbz_path)
+    if remove_loose:
+        for path in paths:
+            os.remove(path)
+        images_dir = os.path.dirname(paths[0]) if paths else None
+        if images_dir and not os.listdir(images_dir):
+            os.rmdir(images_dir)
+    return cbz_path, len(paths), os.path.getsize(cbz_path)
+
+
+class Packager:
+    # hook(event, fields) 接在进度事件上：收到已完成的 entry_done 就提交打包
+    def __init__(self, save_dir, log=print, workers=PACK_WORKERS, remove_loose=False, shared=False):
+        self.manifest = Manifest.for_dir(save_dir, shared)
+        self.log = log
+        self.remove_loose = remove_loose
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._submitted = set()
+        self.packed = 0
+        self.failed = 0
+
+    def hook(self, event, fields):
+        if event == 'entry_done' and fields['status'] in (DONE, 'skipped'):
+            self.submit(fields['url'])
+
+    def submit(self, entry_url):
+        if entry_url in self._submitted:
+            return
+        entry = self.manifest.get_entry(entry_url)
+        if entry is None or entry['status'] != DONE:
+            return
+        cbz_path = cbz_path_for(entry)
+        if os.path.exists(cbz_path):
+            return
+        paths = [img['path'] for img in self.manifest.images(entry_url)]
+        missing = [p for p in paths if not os.path.exists(p)]
+        if missing:
+            self.log(f"【打包跳过】{entry['title']}：缺少{len(missing)}张图片")
+            return
+        self._submitted.add(entry_url)
+        fut = self._executor.submit(build_cbz, cbz_path, entry['title'], paths, self.remove_loose)
+        fut.add_done_callback(lambda f: self._done(entry['title'], f))
+
+    def _done(self, title, fut):
+        err = fut.exception()
+        if err:
+            self.failed += 1
+            self.log(f"【打包失败】{title}，原因：{err}")
+            return
+        cbz_path, count, size = fut.result()
+        self.packed += 1
+        self.log(f"【打包】{title}：{count}张图片 -> {cbz_path}（{size / 1024 / 1024:.1f}MB）")
+
+    def close(self):
+        # 等待所有打包任务完成
+        self._executor.shutdown(wait=True)
+        self.manifest.close()
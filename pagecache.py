@@ -0,0 +1,118 @@
+# HTML 页面磁盘缓存：保存 ETag/Last-Modified，重新请求时带上条件头，
+# 服务器返回 304 就直接读本地副本；总大小超过上限时按最近访问时间(LRU)淘汰
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+INDEX_NAME = 'index.sqlite3'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+"""
+
+
+class PageCache:
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, INDEX_NAME), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _file_for(self, url):
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(digest[:2], digest + '.html')
+
+    def validators(self, url):
+        # 返回条件请求头，没有缓存时返回空字典
+        with self._lock:
+            row = self._db.execute('SELECT etag, last_modified FROM pages WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return {}
+        headers = {}
+        if row[0]:
+            headers['If-None-Match'] = row[0]
+        if row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def load(self, url):
+        # 304 时读取本地副本并刷新访问时间，副本丢失时返回 None
+        with self._lock:
+            row = self._db.execute('SELECT file FROM pages WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            try:
+                with open(os.path.join(self.cache_dir, row[0]), encoding='utf-8') as f:
+                    text = f.read()
+            except OSError:
+                self._db.execute('DELETE FROM pages WHERE url = ?', (url,))
+                self._db.commit()
+                return None
+            self._db.execute('UPDATE pages SET last_access = ? WHERE url = ?', (time.time(), url))
+            self._db.commit()
+            return text
+
+    def store(self, url, text, etag=None, last_modified=None):
+        # 没有校验信息的页面无法重新验证，不缓存
+        if not etag and not last_modified:
+            return
+        rel = self._file_for(url)
+        path = os.path.join(self.cache_dir, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        body = text.encode('utf-8')
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO pages (url, file, etag, last_modified, size, last_access) '
+                             'VALUES (?, ?, ?, ?, ?, ?)',
+                             (url, rel, etag, last_modified, len(body), time.time()))
+            self._db.commit()
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 一次淘汰到上限的 90%，避免每次写入都触发淘汰
+        target = self.max_bytes * 0.9
+        for url, rel, size in self._db.execute(
+                'SELECT url, file, size FROM pages ORDER BY last_access').fetchall():
+            if total <= target:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, rel))
+            except OSError:
+                pass
+            self._db.execute('DELETE FROM pages WHERE url = ?', (url,))
+            total -= size
+        self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            for (rel,) in self._db.execute('SELECT file FROM pages').fetchall():
+                try:
+                    os.remove(os.path.join(self.cache_dir, rel))
+                except OSError:
+                    pass
+            self._db.execute('DELETE FROM pages')
+            self._db.commit()
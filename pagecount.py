@@ -0,0 +1,70 @@
+# 条目分页数：页面上没有可信的分页信息时，用 HEAD 请求探测最后一页
+# 先按 2、4、8… 指数探测找到第一个不存在的页，再在最后存在的页和它之间二分，N 页的条目约 2·log2(N) 次请求
+import threading
+from urllib.parse import urljoin
+import transport
+from extract import MAX_PAGES
+
+# 已探测过的条目：{条目地址: 分页数}
+_cache = {}
+_lock = threading.Lock()
+
+
+def _is_first_page(entry_url, location):
+    return location.rstrip('/') in (entry_url.rstrip('/'), f"{entry_url}/1")
+
+
+def page_exists(entry_url, page):
+    # 200 算存在；越界的分页会 404 或跳转回首页，算不存在
+    # 其他状态(限流重试用完后的 429/5xx 等)抛异常，结果不缓存也不写入清单，条目记为分页失败稍后重试
+    page_url = f"{entry_url}/{page}"
+    resp = transport.head(page_url)
+    resp.close()
+    if resp.status_code == 200:
+        return True
+    if resp.status_code == 404:
+        return False
+    if resp.is_redirect and _is_first_page(entry_url, urljoin(page_url, resp.headers.get('Location', ''))):
+        return False
+    raise IOError(f"探测第{page}页失败：HTTP {resp.status_code}")
+
+
+def probe_end_page(entry_url, exists=page_exists, limit=MAX_PAGES):
+    # 返回 (分页数, 请求次数)；请求出错时抛异常，不缓存不完整的结果
+    requests = 0
+
+    def check(page):
+        nonlocal requests
+        requests += 1
+        return exists(entry_url, page)
+
+    good, bad = 1, 2
+    while bad <= limit and check(bad):
+        good, bad = bad, bad * 2
+    bad = min(bad, limit + 1)
+    while bad - good > 1:
+        mid = (good + bad) // 2
+        if check(mid):
+            good = mid
+        else:
+            bad = mid
+    return good, requests
+
+
+def resolve(entry_url, end_page, manifest=None, log=print):
+    # end_page 为页面上解析出的分页数(None 表示没找到)；找不到时依次用本进程缓存、清单里上次的结果、探测
+    if end_page is not None:
+        return end_page
+    with _lock:
+        cached = _cache.get(entry_url)
+    if cached is None and manifest is not None:
+        # 旧版本可能按整页最大数字记下过几百万页，超过上限的不用
+        entry = manifest.get_entry(entry_url)
+        if entry and entry['end_page'] and entry['end_page'] <= MAX_PAGES:
+            cached = entry['end_page']
+    if cached is None:
+        cached, requests = probe_end_page(entry_url)
+        log(f"未找到分页栏，探测到共{cached}页（{requests}次请求）：{entry_url}")
+    with _lock:
+        _cache[entry_url] = cached
+    return cached
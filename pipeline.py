@@ -0,0 +1,224 @@
+# 条目下载流水线：分页抓取 -> 图片地址提取 -> 图片下载
+# 三段之间用有界队列连接，第一页解析完就开始下载，不必等所有分页都抓完
+# 进度记录在 manifest.Manifest 中，重启后已完成的条目不再发请求，未完成的只补缺失图片
+# 传入 retry.RetryScheduler 时，分页/图片失败会进入重试队列；emit(event, **fields) 接收结构化进度事件
+import os
+import queue
+import threading
+from extract import parse_entry_page, get_image_urls_from_page, complete_img_url, image_save_path
+from manifest import DONE, PARTIAL, FAILED
+from retry import PAGE, EMPTY, IMAGE, NO_IMAGES
+from transport import get_html
+import pagecount
+import metrics
+
+# 分页抓取线程数 / 抓取段与提取段之间的队列长度
+PAGE_FETCHERS = 4
+PAGE_QUEUE_SIZE = 8
+
+
+def _no_emit(event, **fields):
+    pass
+
+
+def _fetch_pages(entry_url, end_page, page_q, workers, gate=None):
+    # 抓取段：多个线程按页码顺序领取分页，结果放入有界队列
+    # 每页抓取前调用 gate()：暂停时等待；任务取消后放入 (页码, None) 并停止，提取段收到后不再等其余分页
+    pages = iter(range(2, end_page + 1))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                page = next(pages, None)
+            if page is None:
+                return
+            if gate is not None and not gate():
+                page_q.put((page, None))
+                return
+            page_q.put((page, get_html(f"{entry_url}/{page}")))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(workers, end_page - 1))]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def _stop_fetchers(threads, page_q):
+    # 取消后抓取线程可能还卡在 put 上，清空队列直到它们都退出
+    while any(t.is_alive() for t in threads):
+        try:
+            page_q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+
+class EntryDownloads:
+    # 下载段：把图片交给线程池，结果在调用线程中记入清单并输出日志
+    # gate() 在提交每张图片前调用，暂停时阻塞，返回 False 表示任务已取消，剩下的图片不再提交
+    def __init__(self, entry_url, title, pool, download_image, manifest, log, retries=None, emit=_no_emit,
+                 gate=None):
+        self.entry_url = entry_url
+        self.title = title
+        self.pool = pool
+        self.download_image = download_image
+        self.manifest = manifest
+        self.log = log
+        self.retries = retries
+        self.emit = emit
+        self.gate = gate
+        self.results = queue.Queue()
+        self.submitted = 0
+        self.skipped = 0
+        self.done = 0
+        self.failed = 0
+
+    def submit(self, idx, img_url, save_path):
+        if self.gate is not None and not self.gate():
+            self.skipped += 1
+            return
+        fut = self.pool.submit(self.download_image, img_url, save_path)
+        fut.add_done_callback(lambda f: self.results.put((idx, img_url, save_path, f)))
+        self.submitted += 1
+        self.drain()
+
+    def _handle(self, idx, img_url, save_path, fut):
+        name = os.path.basename(save_path)
+        err = fut.exception()
+        if err:
+            self.failed += 1
+            self.manifest.mark_image(self.entry_url, idx, FAILED)
+            metrics.error('image', err)
+            self.log(f"图片下载失败: {img_url}，原因：{err}")
+            self.emit('image', entry=self.entry_url, idx=idx, img_url=img_url, path=save_path, status='failed',
+                      error=str(err))
+            if self.retries is not None:
+                self.retries.record(IMAGE, img_url, save_path, self.entry_url, self.title, idx=idx, error=err)
+            return
+        self.done += 1
+        size = os.path.getsize(save_path)
+        self.manifest.mark_image(self.entry_url, idx, DONE, size)
+        self.emit('image', entry=self.entry_url, idx=idx, img_url=img_url, path=save_path,
+                  status=fut.result() if fut.result() in ('skip', 'linked') else 'ok', bytes=size)
+        if fut.result() == 'skip':
+            self.log(f"{name} 已存在，跳过。")
+        elif fut.result() == 'linked':
+            self.log(f"{name} 与已下载的图片相同，直接链接。")
+        else:
+            self.log(f"下载 {name} : {img_url}")
+
+    def drain(self, block=False):
+        while True:
+            try:
+                self._handle(*self.results.get(block=block))
+            except queue.Empty:
+                return
+            block = False
+
+    def wait(self):
+        while self.done + self.failed < self.submitted:
+            self.drain(block=True)
+
+
+def _resume_entry(entry, pool, download_image, manifest, log, retries, emit, gate):
+    # 分页已全部记录在清单里：不请求任何页面，只补下缺失的图片
+    entry_url, title, save_dir = entry['url'], entry['title'], entry['save_dir']
+    missing = [img for img in manifest.images(entry_url) if img['status'] != DONE]
+    log(f"【续传】{title} 缺失{len(missing)}张，保存到 {save_dir}")
+    emit('entry_start', url=entry_url, title=title, save_dir=save_dir, resume=True, missing=len(missing))
+    os.makedirs(save_dir, exist_ok=True)
+    downloads = EntryDownloads(entry_url, title, pool, download_image, manifest, log, retries, emit, gate)
+    for img in missing:
+        downloads.submit(img['idx'], img['url'], img['path'])
+    downloads.wait()
+    return title, save_dir, downloads
+
+
+def _crawl_entry(entry_url, base_save_dir, pool, download_image, manifest, log, retries, emit, gate):
+    html = get_html(entry_url)
+    if not html:
+        raise RuntimeError("条目页请求失败")
+    title, end_page, first_page_imgs = parse_entry_page(html, use_head_title=True, entry_url=entry_url)
+    end_page = pagecount.resolve(entry_url, end_page, manifest, log)
+    save_dir = os.path.join(base_save_dir, title, 'images')
+    os.makedirs(save_dir, exist_ok=True)
+    manifest.save_entry(entry_url, title, save_dir, end_page)
+
+    log(f"【开始】{title} 共{end_page}页，保存到 {save_dir}")
+    emit('entry_start', url=entry_url, title=title, save_dir=save_dir, pages=end_page)
+    page_q = queue.Queue(PAGE_QUEUE_SIZE)
+    fetchers = _fetch_pages(entry_url, end_page, page_q, PAGE_FETCHERS, gate)
+    downloads = EntryDownloads(entry_url, title, pool, download_image, manifest, log, retries, emit, gate)
+    count = 0
+
+    def submit(page, imgs, ok):
+        # 提取段：按页码顺序编号并记入清单，清单里已完成的图片不再下载
+        nonlocal count
+        records = []
+        for img_url in imgs:
+            img_url = complete_img_url(img_url)
+            count += 1
+            records.append((count, img_url, image_save_path(save_dir, count, img_url)))
+        for stale_path in manifest.record_page(entry_url, page, records, ok):
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+        for idx, img_url, save_path in records:
+            if manifest.image_status(entry_url, idx) != DONE:
+                downloads.submit(idx, img_url, save_path)
+
+    def check(page, page_url, page_html, imgs):
+        # 请求失败或没有图片的分页记为失败，条目不会被当成已完成
+        if not page_html:
+            log(f"第{page}页请求失败")
+            if retries is not None:
+                retries.record(PAGE, page_url, entry_url=entry_url, title=title, page=page, error="分页请求失败")
+        elif not imgs:
+            log(f"第{page}页未找到图片")
+            if retries is not None:
+                retries.record(EMPTY, page_url, entry_url=entry_url, title=title, page=page, error=NO_IMAGES)
+        return imgs, bool(imgs)
+
+    submit(1, *check(1, entry_url, html, first_page_imgs))
+    # 分页可能乱序到达，按页码顺序提交
+    ready = {}
+    next_page = 2
+    while next_page <= end_page:
+        page, page_html = page_q.get()
+        if page_html is None:
+            # 任务已取消：还没提交的分页不记入清单，下次运行重新抓取
+            _stop_fetchers(fetchers, page_q)
+            downloads.wait()
+            return title, save_dir, downloads
+        ready[page] = check(page, f"{entry_url}/{page}", page_html, get_image_urls_from_page(page_html))
+        while next_page in ready:
+            submit(next_page, *ready.pop(next_page))
+            next_page += 1
+        downloads.drain()
+    downloads.wait()
+    manifest.trim_images(entry_url, count)
+    return title, save_dir, downloads
+
+
+def run_entry(entry_url, base_save_dir, pool, download_image, log, manifest, retries=None, emit=_no_emit,
+              gate=None):
+    entry = manifest.get_entry(entry_url)
+    if entry and entry['status'] == DONE:
+        log(f"【已完成】{entry['title']}（共{manifest.image_count(entry_url)}张），跳过下载。")
+        emit('entry_done', url=entry_url, title=entry['title'], status='skipped',
+             images=manifest.image_count(entry_url), missing=0)
+        return
+    if entry and manifest.pages_complete(entry_url):
+        title, save_dir, downloads = _resume_entry(entry, pool, download_image, manifest, log, retries, emit, gate)
+    else:
+        title, save_dir, downloads = _crawl_entry(entry_url, base_save_dir, pool, download_image, manifest, log,
+                                                  retries, emit, gate)
+
+    done = manifest.finish_entry(entry_url)
+    if done:
+        log(f"【完成】{title} ：共{manifest.image_count(entry_url)}张图片，已保存在 {save_dir}")
+    else:
+        cancelled = f"，取消{downloads.skipped}张" if downloads.skipped else ""
+        log(f"【未完成】{title} ：本次成功{downloads.done}张，失败{downloads.failed}张{cancelled}，"
+            f"缺失{manifest.missing_count(entry_url)}张，已保存在 {save_dir}")
+    emit('entry_done', url=entry_url, title=title, status=DONE if done else PARTIAL,
+         images=manifest.image_count(entry_url), missing=manifest.missing_count(entry_url))
@@ -0,0 +1,59 @@
+# 图片下载线程池：限制总线程数，同时限制单个图床主机的并发数
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from writer import then
+import bandwidth
+
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 4
+# 已提交但未完成的任务数上限(每个线程)，防止提交方无限堆积任务
+PENDING_PER_WORKER = 4
+
+
+class DownloadPool:
+    def __init__(self, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, max_pending=None):
+        self.workers = workers
+        self.per_host = per_host
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='img')
+        self._pending = threading.BoundedSemaphore(max_pending or workers * PENDING_PER_WORKER)
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        # 已提交未完成的任务数，供指标中的队列深度使用
+        self.in_flight = 0
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host)
+                self._host_slots[host] = slot
+        return slot
+
+    def _run(self, fn, img_url, save_path, share):
+        # share 是提交时所在线程的带宽份额(bandwidth.share)，下载线程里沿用
+        with self._host_slot(img_url), bandwidth.share(share):
+            return fn(img_url, save_path)
+
+    def submit(self, fn, img_url, save_path):
+        # 未完成任务达到上限时阻塞，直到有任务结束
+        # fn 返回 Future(交给了后台写盘线程)时，返回的 Future 等写完才完成，下载线程和槽位在收完时就释放
+        self._pending.acquire()
+        try:
+            fut = self._executor.submit(self._run, fn, img_url, save_path, bandwidth.current_share())
+        except Exception:
+            self._pending.release()
+            raise
+        with self._lock:
+            self.in_flight += 1
+        fut.add_done_callback(self._done)
+        return then(fut, lambda result: result)
+
+    def _done(self, fut):
+        with self._lock:
+            self.in_flight -= 1
+        self._pending.release()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
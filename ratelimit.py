@@ -0,0 +1,203 @@
+# 按主机自适应限流：AIMD 调整并发数和请求间隔
+# 成功时并发数加性增长，遇到 429/5xx 或连接失败/超时时乘性减半；服务器给了 Retry-After 或连续多次失败时暂停该主机
+# 404/403、传输中途断开、写盘失败等与主机负载无关的错误不影响限流
+import email.utils
+import threading
+import time
+from urllib.parse import urlparse
+
+INITIAL_LIMIT = 8
+MIN_LIMIT = 1
+MAX_LIMIT = 32
+# 乘性减小的系数 / 两次减小之间的最短间隔(秒)，避免同一波失败把并发连续砍到底
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 1.0
+# 退避：连续失败这么多次才整体暂停该主机，偶发的失败只靠减小并发处理；基础时长和上限(秒)
+BLOCK_AFTER_FAILURES = 3
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# 请求间隔：被限流时翻倍，成功时逐步缩短，上限(秒)
+INTERVAL_STEP = 0.05
+INTERVAL_MAX = 5.0
+THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+# 视为过载的异常：连接失败和超时。按类名匹配 requests/aiohttp/内置异常，不必为此导入这些库
+OVERLOAD_ERRORS = ('Timeout', 'TimeoutError', 'ConnectionError', 'ClientConnectionError')
+
+
+def is_overload_error(exc):
+    return any(cls.__name__ in OVERLOAD_ERRORS for cls in type(exc).__mro__)
+
+
+def parse_retry_after(value, now=None):
+    # Retry-After 可以是秒数或 HTTP 日期，返回需要等待的秒数
+    if not value:
+        return 0.0
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+    return max(0.0, when - (now or time.time()))
+
+
+class HostLimiter:
+    def __init__(self, host, max_limit=MAX_LIMIT):
+        self.host = host
+        self.max_limit = max_limit
+        self.limit = float(min(INITIAL_LIMIT, max_limit))
+        self.interval = 0.0
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.throttled = 0
+        self._last_start = 0.0
+        self._last_decrease = 0.0
+        self.cond = threading.Condition()
+
+    def try_acquire(self):
+        # 返回 (是否拿到槽位, 建议等待秒数)，调用方需持有 cond
+        now = time.monotonic()
+        wait = max(self.blocked_until - now, self._last_start + self.interval - now)
+        if wait > 0:
+            return False, wait
+        if self.in_flight >= int(self.limit):
+            return False, None
+        self.in_flight += 1
+        self._last_start = now
+        return True, 0
+
+    def release(self, ok, retry_after=0.0):
+        # ok：True 成功，False 过载信号，None 与负载无关(只归还槽位)
+        with self.cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if ok:
+                self.failures = 0
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self.interval = self.interval * 0.9 if self.interval > 0.001 else 0.0
+            elif ok is False:
+                self.failures += 1
+                self.throttled += 1
+                if now - self._last_decrease >= DECREASE_COOLDOWN:
+                    self._last_decrease = now
+                    self.limit = max(MIN_LIMIT, self.limit * DECREASE_FACTOR)
+                    self.interval = min(INTERVAL_MAX, max(INTERVAL_STEP, self.interval * 2))
+                backoff = 0.0
+                if self.failures >= BLOCK_AFTER_FAILURES:
+                    backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - BLOCK_AFTER_FAILURES))
+                if retry_after or backoff:
+                    self.blocked_until = max(self.blocked_until, now + max(retry_after, backoff))
+            self.cond.notify_all()
+
+    def snapshot(self):
+        with self.cond:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'interval': round(self.interval, 3),
+                'blocked_for': round(max(0.0, self.blocked_until - time.monotonic()), 1),
+                'throttled': self.throttled,
+            }
+
+
+class Slot:
+    # 一次请求占用的槽位，请求结束时用 report() 报告响应状态
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.status = None
+        self.throttled = False
+        self.retry_after = 0.0
+
+    def report(self, status, retry_after=None):
+        self.status = status
+        self.throttled = status in THROTTLE_STATUSES
+        self.retry_after = parse_retry_after(retry_after)
+
+    def outcome(self, exc):
+        # 429/5xx 和收到响应前的连接失败/超时算过载；收到响应后的异常(raise_for_status、传输中断开、写盘)
+        # 和 4xx 与主机负载无关
+        if self.throttled:
+            return False
+        if exc is not None:
+            return False if self.status is None and is_overload_error(exc) else None
+        if self.status is not None and self.status >= 400:
+            return None
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.limiter.release(self.outcome(exc), self.retry_after)
+        return False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class RateController:
+    def __init__(self, max_limit=MAX_LIMIT):
+        self.max_limit = max_limit
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            limiter = self._hosts.get(host)
+            if limiter is None:
+                limiter = self._hosts[host] = HostLimiter(host, self.max_limit)
+        return limiter
+
+    def slot(self, url):
+        # 阻塞直到该主机允许再发一个请求
+        limiter = self.limiter(url)
+        with limiter.cond:
+            while True:
+                ok, wait = limiter.try_acquire()
+                if ok:
+                    return Slot(limiter)
+                limiter.cond.wait(wait)
+
+    async def slot_async(self, url):
+        # 协程版本：轮询等待，不阻塞事件循环；只有 asyncio 引擎会调用，到这里 asyncio 早已加载
+        import asyncio
+        limiter = self.limiter(url)
+        while True:
+            with limiter.cond:
+                ok, wait = limiter.try_acquire()
+            if ok:
+                return Slot(limiter)
+            await asyncio.sleep(wait if wait else 0.02)
+
+    def set_max_limit(self, max_limit):
+        with self._lock:
+            self.max_limit = max_limit
+            for limiter in self._hosts.values():
+                with limiter.cond:
+                    limiter.max_limit = max_limit
+                    limiter.limit = min(limiter.limit, max_limit)
+
+    def snapshot(self):
+        with self._lock:
+            limiters = list(self._hosts.values())
+        return {limiter.host: limiter.snapshot() for limiter in limiters}
+
+    def describe(self, throttled_only=False):
+        # 日志用的一行摘要；throttled_only 时只列出被限流过的主机
+        parts = []
+        for host, s in self.snapshot().items():
+            if throttled_only and not s['throttled']:
+                continue
+            text = f"{host} 并发{s['limit']:g} 间隔{s['interval']:g}s"
+            if s['blocked_for']:
+                text += f" 暂停{s['blocked_for']:g}s"
+            if s['throttled']:
+                text += f" 限流{s['throttled']}次"
+            parts.append(text)
+        return '；'.join(parts)
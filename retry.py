@@ -0,0 +1,211 @@
+# 失败重试调度：失败记录保存在下载清单(manifest.sqlite3)的 failures 表里，重启后继续，按指数退避加随机抖动安排重试
+# 图片重试交给下载线程池，与新的下载任务并行；分页请求失败和分页没有图片时重新处理整个条目
+import os
+import queue
+import random
+import re
+import time
+from extract import complete_img_url
+from manifest import DONE, FAILED, PENDING
+import metrics
+
+# 失败类型：分页请求失败 / 分页上没有找到图片 / 图片下载失败
+PAGE = 'page'
+EMPTY = 'empty'
+IMAGE = 'image'
+# 各类型的 (首次等待秒数, 最长等待秒数, 最多重试次数)
+# 没有图片的分页多半是真的没有图片，等得更久、试得更少
+POLICIES = {
+    PAGE: (10, 600, 6),
+    EMPTY: (60, 1800, 2),
+    IMAGE: (5, 600, 8),
+}
+# 等待时间在 [1-JITTER, 1+JITTER] 倍之间随机，避免同一批失败同时重试
+JITTER = 0.5
+# 已提交的图片重试在这段时间内不会被再次提交；程序中途退出时，过了这段时间下次运行会重新提交
+IN_FLIGHT_LEASE = 600
+# 旧版本写出的失败列表文件名 / 其中“没有图片”的原因文字
+FAILED_TXT = 'download_failed.txt'
+NO_IMAGES = '未找到图片'
+# 本模块写出的失败列表带这一行表头；失败记录已在清单里，这样的文件不再导入
+TXT_HEADER = '# 未成功的下载，记录已保存在 manifest.sqlite3，下次运行会继续重试\n'
+
+
+def backoff_delay(kind, attempts):
+    base, cap, _ = POLICIES[kind]
+    return min(cap, base * 2 ** attempts) * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+def _label(row):
+    if row['kind'] == IMAGE:
+        return os.path.basename(row['path']) + ' : ' + row['url']
+    return f"{row['title'] or row['entry_url']} 第{row['page']}页"
+
+
+class RetryScheduler:
+    # poll() 在调用线程中执行：处理已结束的图片重试、提交到期的图片重试、重新处理到期的条目
+    def __init__(self, manifest, pool, download_image, retry_entry, log=print, emit=None, hold=None):
+        # download_image(img_url, save_path) 在下载线程中执行，失败时抛异常
+        # retry_entry(entry_url) 重新处理整个条目，清单会跳过已完成的图片
+        # emit(event, **fields)：重试补齐条目时发出 entry_done 进度事件
+        # hold(entry_url) 返回 True 时这个条目的重试先不处理，留在清单里(所属任务暂停或已取消)
+        self.manifest = manifest
+        self.pool = pool
+        self.download_image = download_image
+        self.retry_entry = retry_entry
+        self.log = log
+        self.emit = emit or (lambda event, **fields: None)
+        self.hold = hold
+        self.results = queue.Queue()
+        self.in_flight = 0
+        self.recovered = 0
+        self.given_up = 0
+
+    def record(self, kind, url, path='', entry_url=None, title=None, page=None, idx=None, error=None):
+        if kind == IMAGE:
+            url = complete_img_url(url)
+        self.manifest.add_failure(kind, url, path, entry_url, title, page, idx,
+                                  str(error) if error else None, time.time() + backoff_delay(kind, 0))
+
+    def _held(self, row):
+        return self.hold is not None and self.hold(row['entry_url'] or row['url'])
+
+    def _next_try(self):
+        if self.hold is None:
+            return self.manifest.next_failure_time()
+        return min((row['next_try'] for row in self.manifest.failures(PENDING) if not self._held(row)), default=None)
+
+    def pending(self):
+        return bool(self.in_flight) or self._next_try() is not None
+
+    def poll(self, timeout=0):
+        # timeout>0 时最多等待这么久，直到有重试到期或有图片重试结束
+        next_try = self._next_try()
+        wait = timeout if next_try is None else min(timeout, max(0.0, next_try - time.time()))
+        if self.in_flight:
+            self.drain(wait)
+        elif wait > 0:
+            time.sleep(wait)
+        entries = {}
+        for row in self.manifest.due_failures(time.time()):
+            if self._held(row):
+                continue
+            if row['kind'] == IMAGE:
+                self._submit_image(row)
+            else:
+                entries.setdefault(row['entry_url'] or row['url'], []).append(row)
+        for entry_url, rows in entries.items():
+            self._retry_entry(entry_url, rows)
+        self.drain()
+
+    def drain(self, timeout=0):
+        block = timeout > 0
+        while True:
+            try:
+                row, fut = self.results.get(block=block, timeout=timeout if block else None)
+            except queue.Empty:
+                return
+            block = False
+            self.in_flight -= 1
+            err = fut.exception()
+            if err:
+                self._failed_again(row, err)
+            else:
+                self._image_done(row)
+
+    def _submit_image(self, row):
+        entry_url, idx, path = row['entry_url'], row['idx'], row['path']
+        if os.path.exists(path) or (entry_url and idx and self.manifest.image_status(entry_url, idx) == DONE):
+            self._image_done(row)
+            return
+        self.manifest.reschedule_failure(row['kind'], row['url'], path, row['attempts'],
+                                         time.time() + IN_FLIGHT_LEASE, row['error'])
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.log(f"重试下载（第{row['attempts'] + 1}次）：{_label(row)}")
+        fut = self.pool.submit(self.download_image, row['url'], path)
+        self.in_flight += 1
+        fut.add_done_callback(lambda f: self.results.put((row, f)))
+
+    def _image_done(self, row):
+        entry_url, idx, path = row['entry_url'], row['idx'], row['path']
+        if entry_url and idx and os.path.exists(path):
+            self.manifest.mark_image(entry_url, idx, DONE, os.path.getsize(path))
+            if self.manifest.finish_entry(entry_url):
+                count = self.manifest.image_count(entry_url)
+                self.log(f"【完成】{row['title'] or entry_url} ：共{count}张图片")
+                self.emit('entry_done', url=entry_url, title=row['title'], status=DONE, images=count, missing=0)
+        self._resolved(row)
+
+    def _retry_entry(self, entry_url, rows):
+        self.log(f"【重试】{rows[0]['title'] or entry_url}：" + '，'.join(f"第{r['page']}页" for r in rows))
+        try:
+            self.retry_entry(entry_url)
+            err = None
+        except Exception as e:
+            err = e
+        for row in rows:
+            if self.manifest.page_status(entry_url, row['page']) == DONE:
+                self._resolved(row)
+            else:
+                self._failed_again(row, err or row['error'] or '重新处理后仍未成功')
+
+    def _resolved(self, row):
+        self.manifest.remove_failure(row['kind'], row['url'], row['path'])
+        self.recovered += 1
+        self.log(f"【重试成功】{_label(row)}")
+
+    def _failed_again(self, row, err):
+        metrics.error('retry', err)
+        attempts = row['attempts'] + 1
+        if attempts >= POLICIES[row['kind']][2]:
+            self.manifest.reschedule_failure(row['kind'], row['url'], row['path'], attempts, time.time(),
+                                             str(err), FAILED)
+            self.given_up += 1
+            self.log(f"【放弃重试】{_label(row)}：已重试{attempts}次，原因：{err}")
+            return
+        delay = backoff_delay(row['kind'], attempts)
+        self.manifest.reschedule_failure(row['kind'], row['url'], row['path'], attempts, time.time() + delay,
+                                         str(err))
+        self.log(f"重试失败：{_label(row)}，{delay:.0f}秒后再试，原因：{err}")
+
+    def import_failed_txt(self, txt_path):
+        # 导入旧版本写下的失败列表：标题\t第N页\t地址\t图片路径\t原因，导入后改名为 .imported
+        count = 0
+        with open(txt_path, encoding='utf-8') as f:
+            if f.readline() == TXT_HEADER:
+                return 0
+            f.seek(0)
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) < 4:
+                    continue
+                title, page_text, url, path = parts[:4]
+                err = parts[4] if len(parts) > 4 else ''
+                m = re.search(r'\d+', page_text)
+                page = int(m.group()) if m else 1
+                if path:
+                    image = self.manifest.image_by_path(path)
+                    self.record(IMAGE, url, path, image and image['entry_url'], title, page,
+                                image and image['idx'], err)
+                else:
+                    entry_url = url if page == 1 else url.rsplit('/', 1)[0]
+                    self.record(EMPTY if err == NO_IMAGES else PAGE, url, '', entry_url,
+                                None if title == url else title, page, None, err)
+                count += 1
+        os.replace(txt_path, txt_path + '.imported')
+        return count
+
+    def write_failed_txt(self, txt_path):
+        # 把仍未成功的失败写成与旧版本相同格式的文本，返回条数；全部成功时删除上次写出的文件
+        rows = self.manifest.failures()
+        if not rows:
+            if os.path.exists(txt_path):
+                os.remove(txt_path)
+            return 0
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            f.write(TXT_HEADER)
+            for row in rows:
+                state = '已放弃' if row['status'] == FAILED else '待重试'
+                f.write(f"{row['title'] or row['entry_url']}\t第{row['page']}页\t{row['url']}\t{row['path']}\t"
+                        f"{row['error'] or ''}\t{state}，已重试{row['attempts']}次\n")
+        return len(rows)
@@ -0,0 +1,158 @@
+# 按内容寻址的图片仓库：每份图片内容按 SHA-256 只保存一份，各漫画目录里的 {idx:03d} 文件是指向仓库对象的硬链接
+# 清单里记录 图片地址->哈希，同一地址再次出现时直接链接，不再下载
+import hashlib
+import os
+import sys
+import threading
+from concurrent.futures import Future
+from manifest import Manifest, MANIFEST_NAME
+from writer import then
+
+STORE_DIR = '.store'
+# 计算哈希时每次读取的字节数
+HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _format_size(n):
+    for unit in ('B', 'KB', 'MB'):
+        if n < 1024:
+            return f"{n:.0f}{unit}" if unit == 'B' else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GB"
+
+
+class ContentStore:
+    def __init__(self, root, manifest):
+        self.root = root
+        self.manifest = manifest
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        # 本次运行通过链接省掉的下载次数和字节数
+        self.linked = 0
+        self.saved_bytes = 0
+
+    @classmethod
+    def for_dir(cls, save_dir, manifest):
+        return cls(os.path.join(save_dir, STORE_DIR), manifest)
+
+    def object_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _link(self, src, dst):
+        # 先链接到临时名再原子替换，目标原有的重复文件随之释放
+        tmp = f"{dst}.{threading.get_ident()}.link"
+        os.link(src, tmp)
+        os.replace(tmp, dst)
+
+    def link_known(self, img_url, save_path):
+        # 清单里有该地址的哈希且仓库中有对应对象时，直接链接到 save_path，返回 True
+        blob = self.manifest.blob_for_url(img_url)
+        if blob is None:
+            return False
+        obj = self.object_path(blob['sha256'])
+        if not os.path.exists(obj):
+            return False
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        try:
+            self._link(obj, save_path)
+        except OSError:
+            return False
+        with self._lock:
+            self.linked += 1
+            self.saved_bytes += blob['size']
+        return True
+
+    def ingest(self, path, img_url):
+        # 计算哈希并把 path 换成指向仓库对象的硬链接；对象已存在说明是重复内容
+        # 文件系统不支持硬链接时(如 FAT32/exFAT、跨分区)保留原文件，只记录哈希
+        digest = file_sha256(path)
+        obj = self.object_path(digest)
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        try:
+            if not os.path.exists(obj):
+                os.link(path, obj)
+            elif not os.path.samefile(obj, path):
+                self._link(obj, path)
+        except FileExistsError:
+            # 另一个线程刚存入了相同内容
+            self._link(obj, path)
+        except OSError:
+            pass
+        self.manifest.record_blob(img_url, digest, os.path.getsize(path))
+        return digest
+
+    def wrap(self, download_image):
+        # 包装 download_image(img_url, save_path)：已知地址直接链接，下载完成后存入仓库
+        def download(img_url, save_path):
+            if not os.path.exists(save_path) and self.link_known(img_url, save_path):
+                return 'linked'
+            result = download_image(img_url, save_path)
+            if isinstance(result, Future):
+                # 后台写盘：写完后在写盘线程里存入仓库
+                return then(result, lambda r: self._ingest_result(r, save_path, img_url))
+            return self._ingest_result(result, save_path, img_url)
+        return download
+
+    def _ingest_result(self, result, save_path, img_url):
+        if result != 'skip' or self.manifest.blob_for_url(img_url) is None:
+            self.ingest(save_path, img_url)
+        return result
+
+    def backfill(self, log=print):
+        # 把启用仓库之前下载的图片也存入仓库，返回处理的图片数
+        count = 0
+        for img in self.manifest.images_without_blob():
+            if os.path.exists(img['path']):
+                self.ingest(img['path'], img['url'])
+                count += 1
+                if count % 500 == 0:
+                    log(f"已存入{count}张图片")
+        return count
+
+    def prune(self):
+        # 删除不再被任何漫画目录引用的对象(硬链接数为 1)，返回释放的字节数
+        freed = 0
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                st = os.stat(path)
+                if st.st_nlink == 1:
+                    os.remove(path)
+                    freed += st.st_size
+        return freed
+
+    def report(self):
+        # 去重报告：图片数、不同内容数、逻辑大小/实际占用，以及出现次数最多的重复内容
+        stats = self.manifest.dedupe_stats()
+        lines = [f"图片{stats['images']}张，不同内容{stats['unique']}份",
+                 f"逻辑大小{_format_size(stats['logical_bytes'])}，实际占用{_format_size(stats['physical_bytes'])}，"
+                 f"节省{_format_size(stats['logical_bytes'] - stats['physical_bytes'])}"]
+        if self.linked:
+            lines.append(f"本次直接链接{self.linked}张，少下载{_format_size(self.saved_bytes)}")
+        for dup in stats['top']:
+            lines.append(f"  {dup['sha256'][:12]} 出现{dup['count']}次，涉及{dup['entries']}个漫画，"
+                         f"每份{_format_size(dup['size'])}，例如 {dup['example']}")
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    # python store.py <保存目录>：把已有图片存入仓库并输出去重报告
+    if len(sys.argv) != 2 or not os.path.exists(os.path.join(sys.argv[1], MANIFEST_NAME)):
+        print("用法：python store.py <保存目录>，保存目录下需要有 manifest.sqlite3")
+        sys.exit(1)
+    manifest = Manifest(os.path.join(sys.argv[1], MANIFEST_NAME))
+    try:
+        store = ContentStore.for_dir(sys.argv[1], manifest)
+        print(f"新存入{store.backfill()}张图片")
+        print(f"清理未引用对象，释放{_format_size(store.prune())}")
+        print(store.report())
+    finally:
+        manifest.close()
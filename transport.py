@@ -0,0 +1,217 @@
+# 共享 HTTP 传输层：所有脚本通过同一个带连接池的 requests.Session 发请求，
+# 复用 keep-alive 连接，统一请求头和超时
+import os
+import re
+import threading
+import time
+from ratelimit import RateController
+from bandwidth import Governor
+import metrics
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
+}
+# (连接超时, 读取超时)，单位秒
+TIMEOUT = (10, 16)
+# 缓存连接池的主机数 / 每个主机保留的 keep-alive 连接数
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 64
+# 图片下载的读写块大小 / 未完成文件的后缀
+CHUNK_SIZE = 256 * 1024
+PART_SUFFIX = '.part'
+# 个别主机单独指定连接池大小，例如 {'img.177pica.com': 128}
+HOST_POOL_SIZES = {}
+# 遇到 429/5xx 时的重试次数，等待时间由限流器按 Retry-After/指数退避决定
+THROTTLE_RETRIES = 3
+
+# 所有请求共用的按主机自适应限流器，rate_limit.snapshot() 可查看当前各主机的并发和间隔
+rate_limit = RateController()
+# 图片下载的全局带宽限制，bandwidth_limit.set_rate() 运行中随时可调，默认不限速
+bandwidth_limit = Governor()
+
+_session = None
+_lock = threading.Lock()
+# HTML 页面缓存(pagecache.PageCache)，None 表示不使用缓存
+_page_cache = None
+
+
+def _build_session():
+    # requests 在第一次发请求时才导入，命令行 --help、窗口刚打开时不用等它
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    for host, size in HOST_POOL_SIZES.items():
+        host_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+        session.mount(f'http://{host}/', host_adapter)
+        session.mount(f'https://{host}/', host_adapter)
+    return session
+
+
+def configure(pool_maxsize=None, host_pool_sizes=None, timeout=None, max_per_host=None):
+    # 修改连接池/超时配置，下次 get_session() 时按新配置重建会话
+    # max_per_host 是限流器对单个主机允许增长到的最大并发数
+    global POOL_MAXSIZE, TIMEOUT, _session
+    if max_per_host is not None:
+        rate_limit.set_max_limit(max_per_host)
+    with _lock:
+        if pool_maxsize is not None:
+            POOL_MAXSIZE = pool_maxsize
+        if host_pool_sizes:
+            HOST_POOL_SIZES.update(host_pool_sizes)
+        if timeout is not None:
+            TIMEOUT = timeout
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            _session = _build_session()
+        return _session
+
+
+def get(url, kind='page', method='GET', **kwargs):
+    # 非流式请求在限流槽位内完成；被限流时等限流器放行后重试
+    kwargs.setdefault('timeout', TIMEOUT)
+    for attempt in range(THROTTLE_RETRIES + 1):
+        with rate_limit.slot(url) as slot:
+            sent = time.perf_counter()
+            resp = get_session().request(method, url, **kwargs)
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - sent, kind=kind)
+            metrics.REQUESTS.inc(kind=kind, status=resp.status_code)
+            slot.report(resp.status_code, resp.headers.get('Retry-After'))
+        if not slot.throttled or attempt == THROTTLE_RETRIES:
+            return resp
+        resp.close()
+
+
+def head(url):
+    # 只取响应头的轻量请求，不跟随跳转(分页越界时 WordPress 会跳回条目首页)
+    return get(url, kind='probe', method='HEAD', allow_redirects=False)
+
+
+def set_page_cache(cache):
+    global _page_cache
+    _page_cache = cache
+
+
+def get_page_cache():
+    return _page_cache
+
+
+def get_html(url, use_cache=True):
+    # 请求失败时返回空字符串，由调用方决定如何处理
+    cache = _page_cache if use_cache else None
+    start = time.perf_counter()
+    try:
+        resp = get(url, headers=cache.validators(url) if cache else None)
+        if resp.status_code == 304 and cache:
+            text = cache.load(url)
+            if text is not None:
+                metrics.PAGES.inc(result='cached')
+                return text
+            # 本地副本丢失，重新完整请求
+            return get_html(url, use_cache=False)
+        if resp.status_code != 200:
+            # 限流重试用完后的 429/5xx、404 等：错误页的内容不能当成页面解析
+            metrics.PAGES.inc(result='empty')
+            metrics.error('page', f'HTTP {resp.status_code}')
+            resp.close()
+            return ''
+        resp.encoding = resp.apparent_encoding
+        text = resp.text
+        if cache:
+            cache.store(url, text, resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+        metrics.PAGES.inc(result='ok')
+        metrics.BYTES.inc(len(resp.content), kind='page')
+        return text
+    except Exception as e:
+        metrics.PAGES.inc(result='empty')
+        metrics.error('page', e)
+        return ''
+    finally:
+        metrics.PAGE_SECONDS.observe(time.perf_counter() - start)
+
+
+def resume_offset(status, headers, offset):
+    # 服务器按 Range 返回了从 offset 开始的内容时返回 offset，否则需要从头写
+    if offset and status == 206:
+        m = re.match(r'bytes (\d+)-', headers.get('Content-Range', ''))
+        if m and int(m.group(1)) == offset:
+            return offset
+    return 0
+
+
+def download_file(url, save_path, chunk_size=None, writer=None):
+    # 先写入 .part 文件，完整后原子改名为目标文件，避免留下被当成已完成的残缺图片
+    # 上次中断留下的 .part 用 Range 请求续传，服务器不支持时从头下载
+    # 传入 writer.WriteBehind 时各块交给写盘线程追加到 .part，改名也由它完成，返回改名后完成的 Future
+    part_path = save_path + PART_SUFFIX
+    started = time.perf_counter()
+    disk_seconds = 0.0
+    for attempt in range(THROTTLE_RETRIES + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+        # 流式下载整个传输过程都占用限流槽位
+        with rate_limit.slot(url) as slot:
+            sent = time.perf_counter()
+            with get_session().get(url, headers=headers, stream=True, timeout=TIMEOUT) as resp:
+                metrics.REQUEST_SECONDS.observe(time.perf_counter() - sent, kind='image')
+                metrics.REQUESTS.inc(kind='image', status=resp.status_code)
+                slot.report(resp.status_code, resp.headers.get('Retry-After'))
+                if slot.throttled and attempt < THROTTLE_RETRIES:
+                    continue
+                if resp.status_code == 416 and offset:
+                    # .part 与服务器文件对不上，丢弃后重新下载
+                    os.remove(part_path)
+                    continue
+                resp.raise_for_status()
+                start = resume_offset(resp.status_code, resp.headers, offset)
+                # 压缩传输时 Content-Length 是压缩后的长度，无法用来校验
+                length = resp.headers.get('Content-Length')
+                compressed = resp.headers.get('Content-Encoding', 'identity') != 'identity'
+                expected = start + int(length) if length and length.isdigit() and not compressed else None
+                if writer is not None:
+                    part = writer.open(save_path, start)
+                    try:
+                        for chunk in resp.iter_content(chunk_size or CHUNK_SIZE):
+                            writer.append(part, chunk)
+                            metrics.BYTES.inc(len(chunk), kind='image')
+                            bandwidth_limit.consume(len(chunk))
+                    except BaseException:
+                        # 已收到的部分留在 .part 里，下次续传
+                        writer.abort(part)
+                        raise
+                    break
+                with open(part_path, 'ab' if start else 'wb') as f:
+                    for chunk in resp.iter_content(chunk_size or CHUNK_SIZE):
+                        t = time.perf_counter()
+                        f.write(chunk)
+                        disk_seconds += time.perf_counter() - t
+                        metrics.BYTES.inc(len(chunk), kind='image')
+                        bandwidth_limit.consume(len(chunk))
+        break
+    else:
+        raise IOError(f"多次重试后仍未下载成功：{url}")
+    if writer is not None:
+        if expected is not None and part.size != expected:
+            writer.abort(part)
+            raise IOError(f"下载不完整：{part.size}/{expected} 字节")
+        # 写盘耗时由写盘线程计入指标，这里只记网络部分
+        metrics.IMAGE_SECONDS.observe(time.perf_counter() - started)
+        return writer.commit(part)
+    size = os.path.getsize(part_path)
+    if expected is not None and size != expected:
+        raise IOError(f"下载不完整：{size}/{expected} 字节")
+    t = time.perf_counter()
+    os.replace(part_path, save_path)
+    metrics.DISK_SECONDS.inc(disk_seconds + time.perf_counter() - t)
+    metrics.IMAGE_SECONDS.observe(time.perf_counter() - started)
+    return size
@@ -0,0 +1,165 @@
+# 分布式工作队列：协调者把条目地址写入保存目录下的 workqueue.sqlite3，多个工作进程
+# (同一台机器或共享同一文件系统的多台机器)按租约领取条目；工作进程定期续约，进程死掉后租约过期，条目回到队列
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+QUEUE_NAME = 'workqueue.sqlite3'
+# 租约时长 / 续约间隔(秒)：续约间隔要远小于租约时长，工作进程卡住或死掉后最多 LEASE_SECONDS 条目就会被别人领走
+LEASE_SECONDS = 300
+HEARTBEAT_SECONDS = 60
+# 同一条目租约过期(工作进程死掉)超过这么多次就标记为失败，避免一个会让进程崩溃的条目反复拖垮工作进程
+MAX_ATTEMPTS = 3
+# 多个进程同时写队列时等待锁的时间(秒)
+BUSY_TIMEOUT = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    url TEXT PRIMARY KEY,
+    title TEXT,
+    category_url TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    added REAL,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until);
+"""
+
+# 条目状态
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def worker_id():
+    # 主机名 + 进程号，多台机器共享队列时也不会重复
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class WorkQueue:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # 不用 WAL：WAL 依赖共享内存，不能跨机器；默认的回滚日志靠文件锁，共享文件系统上也能用
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=DELETE')
+        self._db.executescript(_SCHEMA)
+
+    @classmethod
+    def for_dir(cls, save_dir):
+        os.makedirs(save_dir, exist_ok=True)
+        return cls(os.path.join(save_dir, QUEUE_NAME))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _transaction(self, fn):
+        # BEGIN IMMEDIATE 一开始就拿写锁，两个进程不会领到同一个条目
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(self._db)
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+            return result
+
+    def push(self, entries, category_url=None):
+        # entries 为 (条目地址, 标题)；已完成或失败的条目重新入队(清单会跳过已下载的图片)，排队中的保持不变
+        # 返回新加入或重新入队的条目数
+        now = time.time()
+
+        def run(db):
+            count = 0
+            for url, title in entries:
+                cur = db.execute(
+                    'INSERT INTO jobs (url, title, category_url, status, attempts, added, updated) '
+                    'VALUES (?, ?, ?, ?, 0, ?, ?) '
+                    'ON CONFLICT(url) DO UPDATE SET status = excluded.status, attempts = 0, error = NULL, '
+                    'owner = NULL, lease_until = NULL, title = COALESCE(excluded.title, title), '
+                    'category_url = COALESCE(excluded.category_url, category_url), updated = excluded.updated '
+                    'WHERE status IN (?, ?)',
+                    (url, title, category_url, QUEUED, now, now, DONE, FAILED))
+                count += cur.rowcount
+            return count
+        return self._transaction(run)
+
+    def claim(self, owner, lease=LEASE_SECONDS):
+        # 领取一个排队中或租约已过期的条目，没有可领的返回 None
+        now = time.time()
+
+        def run(db):
+            db.execute('UPDATE jobs SET status = ?, owner = NULL, error = ?, updated = ? '
+                       'WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                       (FAILED, '工作进程多次在处理中退出', now, LEASED, now, MAX_ATTEMPTS))
+            row = db.execute('SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_until < ?) '
+                             'ORDER BY added, rowid LIMIT 1', (QUEUED, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE jobs SET status = ?, owner = ?, lease_until = ?, attempts = attempts + 1, '
+                       'updated = ? WHERE url = ?', (LEASED, owner, now + lease, now, row['url']))
+            return dict(row)
+        return self._transaction(run)
+
+    def renew(self, owner, lease=LEASE_SECONDS):
+        # 续约该工作进程持有的全部条目
+        self._transaction(lambda db: db.execute(
+            'UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = ?', (time.time() + lease, owner, LEASED)))
+
+    def complete(self, url, owner):
+        # 租约已被别人接手时不覆盖对方的状态
+        self._transaction(lambda db: db.execute(
+            'UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL, updated = ? '
+            'WHERE url = ? AND owner = ? AND status = ?', (DONE, time.time(), url, owner, LEASED)))
+
+    def release(self, owner):
+        # 正常退出(Ctrl+C、SIGTERM)时把手上的条目放回队列，不必等租约过期
+        self._transaction(lambda db: db.execute(
+            'UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0), '
+            'updated = ? WHERE owner = ? AND status = ?', (QUEUED, time.time(), owner, LEASED)))
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def heartbeat(self, owner, interval=HEARTBEAT_SECONDS, lease=LEASE_SECONDS):
+        return Heartbeat(self, owner, interval, lease)
+
+
+class Heartbeat:
+    # with queue.heartbeat(owner): 后台线程定期续约，退出时放回未完成的条目
+    def __init__(self, queue, owner, interval, lease):
+        self.queue = queue
+        self.owner = owner
+        self.interval = interval
+        self.lease = lease
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.queue.renew(self.owner, self.lease)
+            except sqlite3.Error:
+                # 锁等待超时之类的临时错误，下一次再续
+                pass
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.queue.release(self.owner)
@@ -0,0 +1,227 @@
+# 后台写盘(write-behind)：下载线程把收到的每一块交给专门的写盘线程追加到 .part 文件，自己接着收，
+# 保存目录在 NAS、移动硬盘上时写盘变慢不会卡住网络；内存里待写的字节数有上限，写不过来时下载线程才等待
+# .part 照常按块落盘，中断后仍可用 Range 续传；收完后的 fsync 和改名也由写盘线程完成
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import metrics
+from transport import PART_SUFFIX
+
+# 写盘线程数 / 内存中待写内容的上限(字节)
+WRITER_WORKERS = 4
+WRITE_BUFFER_BYTES = 64 * 1024 * 1024
+# 写盘线程一次最多取出的操作数(打开、写块、改名)，同一批改名的文件所在目录只 fsync 一次
+WRITE_BATCH = 32
+# fsync 策略：none 交给操作系统刷盘；file 每个文件写完先 fsync 再改名，每批结束后对涉及的目录 fsync 一次
+FSYNC_NONE = 'none'
+FSYNC_FILE = 'file'
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_FILE)
+# 写盘线程的操作
+_OPEN = 'open'
+_DATA = 'data'
+_COMMIT = 'commit'
+_ABORT = 'abort'
+
+
+def then(fut, fn):
+    # 返回一个新 Future：fut 完成后用 fn(结果) 的返回值完成；fut 的结果本身是 Future(交给了写盘线程)时等它完成
+    # fn 在完成 fut 的线程里执行，异常会传给新 Future
+    result = Future()
+
+    def done(f):
+        err = f.exception()
+        if err is not None:
+            result.set_exception(err)
+        elif isinstance(f.result(), Future):
+            f.result().add_done_callback(done)
+        else:
+            try:
+                result.set_result(fn(f.result()))
+            except Exception as e:
+                result.set_exception(e)
+
+    fut.add_done_callback(done)
+    return result
+
+
+def _fsync_dir(path):
+    # Windows 不能打开目录，跳过
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class PartFile:
+    # 一个正在写的 .part 文件，由 WriteBehind.open() 创建；它的所有操作都在同一个写盘线程里按顺序执行
+    # size 为续传起点加上已交给写盘线程的字节数
+    def __init__(self, save_path, start, ops):
+        self.save_path = save_path
+        self.part_path = save_path + PART_SUFFIX
+        self.start = start
+        self.size = start
+        self.error = None
+        self._ops = ops
+        self._file = None
+        self._closed = threading.Event()
+
+
+class WriteBehind:
+    def __init__(self, workers=WRITER_WORKERS, max_bytes=WRITE_BUFFER_BYTES, fsync=FSYNC_NONE):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"未知的 fsync 策略：{fsync}")
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.pending_bytes = 0
+        self._cond = threading.Condition()
+        # 每个写盘线程一个队列，新文件轮流分给各线程
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._next = itertools.count()
+        # 已经创建过的目录，后面的文件不再重复 makedirs
+        self._dirs = set()
+        self._dirs_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, args=(q,), daemon=True, name=f'writer-{i}')
+                         for i, q in enumerate(self._queues)]
+        for t in self._threads:
+            t.start()
+
+    def open(self, save_path, start=0):
+        # 在下载线程中调用：start 为续传起点(已在 .part 中的字节数)，0 表示从头写
+        part = PartFile(save_path, start, self._queues[next(self._next) % len(self._queues)])
+        part._ops.put((_OPEN, part, None))
+        return part
+
+    def append(self, part, chunk):
+        # 在下载线程中调用：待写内容超过上限时阻塞；这个文件写盘已经出错时直接抛出，不必收完
+        if part.error is not None:
+            raise part.error
+        with self._cond:
+            while self.pending_bytes and self.pending_bytes + len(chunk) > self.max_bytes:
+                self._cond.wait()
+            self.pending_bytes += len(chunk)
+        part.size += len(chunk)
+        part._ops.put((_DATA, part, chunk))
+
+    def commit(self, part, result='ok'):
+        # 收完后调用，返回 Future：前面的块写完、按策略 fsync 并改名为目标文件后结果为 result
+        fut = Future()
+        part._ops.put((_COMMIT, part, (fut, result)))
+        return fut
+
+    def abort(self, part):
+        # 下载中断或不完整时调用：等已交出的块写完并关闭文件，留下的 .part 下次用 Range 续传
+        part._ops.put((_ABORT, part, None))
+        part._closed.wait()
+
+    def _make_dir(self, path):
+        with self._dirs_lock:
+            if path in self._dirs:
+                return
+        if path:
+            os.makedirs(path, exist_ok=True)
+        with self._dirs_lock:
+            self._dirs.add(path)
+
+    def _fail(self, part, e):
+        if part.error is None:
+            metrics.error('disk', e)
+            part.error = e
+        self._close(part)
+
+    def _close(self, part):
+        if part._file is not None:
+            try:
+                part._file.close()
+            except OSError:
+                pass
+            part._file = None
+
+    def _open(self, part):
+        try:
+            self._make_dir(os.path.dirname(part.part_path))
+            part._file = open(part.part_path, 'ab' if part.start else 'wb')
+        except OSError as e:
+            self._fail(part, e)
+
+    def _write(self, part, chunk):
+        if part._file is None:
+            return
+        try:
+            part._file.write(chunk)
+        except OSError as e:
+            self._fail(part, e)
+
+    def _commit(self, part):
+        # 与 transport.download_file 一样完整后才原子改名
+        if part._file is None:
+            return
+        try:
+            if self.fsync == FSYNC_FILE:
+                part._file.flush()
+                os.fsync(part._file.fileno())
+            part._file.close()
+            part._file = None
+            os.replace(part.part_path, part.save_path)
+        except OSError as e:
+            self._fail(part, e)
+
+    def _run(self, ops):
+        while True:
+            batch = [ops.get()]
+            while batch[-1] is not None and len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(ops.get_nowait())
+                except queue.Empty:
+                    break
+            items = [item for item in batch if item is not None]
+            if items:
+                self._write_batch(items)
+            if batch[-1] is None:
+                return
+
+    def _write_batch(self, items):
+        start = time.perf_counter()
+        written = 0
+        committed = []
+        for op, part, arg in items:
+            if op == _OPEN:
+                self._open(part)
+            elif op == _DATA:
+                written += len(arg)
+                self._write(part, arg)
+            elif op == _COMMIT:
+                self._commit(part)
+                committed.append((part, *arg))
+                part._closed.set()
+            else:
+                self._close(part)
+                part._closed.set()
+        if self.fsync == FSYNC_FILE:
+            for path in {os.path.dirname(part.save_path) for part, _, _ in committed if part.error is None}:
+                try:
+                    _fsync_dir(path or '.')
+                except OSError:
+                    pass
+        metrics.DISK_SECONDS.inc(time.perf_counter() - start)
+        with self._cond:
+            self.pending_bytes -= written
+            self._cond.notify_all()
+        # 整批写完(按策略落盘)后才通知调用方，清单里标记完成的图片一定已经在磁盘上
+        for part, fut, result in committed:
+            if part.error is not None:
+                fut.set_exception(part.error)
+            else:
+                fut.set_result(result)
+
+    def close(self):
+        # 写完队列中剩下的内容再返回
+        for ops in self._queues:
+            ops.put(None)
+        for t in self._threads:
+            t.join()